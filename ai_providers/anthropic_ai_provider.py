@@ -1,6 +1,9 @@
+import logging
 import os
 import anthropic
 
+logger = logging.getLogger(__name__)
+
 
 def build_model_handle():
     handle = os.environ["ANTHROPIC_MODEL"]  # e.g. "claude-3-5-sonnet"
@@ -16,8 +19,8 @@ def build_client():
 if os.environ["AI_PROVIDER"] == "anthropic":
     MODEL = build_model_handle()
     CLIENT = build_client()
-    print(f"Loaded Anthropic model: {MODEL}")
-    print(f"Loaded Anthropic client: {CLIENT}")
+    logger.info("Loaded Anthropic model: %s", MODEL)
+    logger.debug("Loaded Anthropic client: %s", CLIENT)
 else:
     MODEL = None
     CLIENT = None
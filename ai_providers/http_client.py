@@ -0,0 +1,22 @@
+import httpx
+
+# One pooled HTTP/2 client shared by the async provider modules, so concurrent
+# requests to the same API multiplex over a few kept-alive connections
+HTTP_LIMITS = httpx.Limits(max_keepalive_connections=100, max_connections=500, keepalive_expiry=60.0)
+HTTP_TIMEOUT = httpx.Timeout(60.0, connect=5.0)
+
+_HTTP_CLIENT = None
+
+
+def get_http_client():
+    global _HTTP_CLIENT
+    if _HTTP_CLIENT is None or _HTTP_CLIENT.is_closed:
+        _HTTP_CLIENT = httpx.AsyncClient(http2=True, limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT)
+    return _HTTP_CLIENT
+
+
+async def aclose_http_client():
+    global _HTTP_CLIENT
+    if _HTTP_CLIENT is not None and not _HTTP_CLIENT.is_closed:
+        await _HTTP_CLIENT.aclose()
+    _HTTP_CLIENT = None
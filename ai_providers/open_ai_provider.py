@@ -1,20 +1,99 @@
+import asyncio
+import hashlib
+import logging
 import os
-from openai import OpenAI  # pip install openai
+import re
+import sys
+import uuid
+from collections import Counter, namedtuple
+from functools import lru_cache
+
+import orjson
+from cachetools import TTLCache
+from openai import (  # pip install openai
+    APIConnectionError,
+    APITimeoutError,
+    AsyncOpenAI,
+    AuthenticationError,
+    BadRequestError,
+    InternalServerError,
+    NotFoundError,
+    PermissionDeniedError,
+    RateLimitError,
+)
+from tenacity import AsyncRetrying, retry_if_exception_type, stop_after_attempt, wait_exponential_jitter
+
+from ai_providers.http_client import get_http_client
+from ai_providers.rate_limiter import RateLimiter, estimate_tokens
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
 
 MODEL_CLASSES = ["o1", "4o", "gpt-4.1", "gpt-5", "gpt-5-chat"]
 
 MODELS_NOT_SUPPORTING_SYS_MSG = ["o1"]
 MODELS_NOT_SUPPORTING_VERBOSITY = ["gpt-5-chat"]
 USE_LEGACY_CHAT_COMPLETIONS_FOR_THESE = ["gpt-4.1", "gpt-5-chat"]
+# Longest tokens first, so "gpt-5-chat" is matched before shorter prefixes
+_LEGACY_TOKENS_BY_LENGTH = sorted(USE_LEGACY_CHAT_COMPLETIONS_FOR_THESE, key=len, reverse=True)
+
+# Lowercased once at import, so the model-name helpers only lower the model name
+_MODEL_CLASSES_LOWER = tuple((c.lower(), c) for c in MODEL_CLASSES)
+_LEGACY_TOKENS_LOWER = tuple(t.lower() for t in _LEGACY_TOKENS_BY_LENGTH)
+_NO_VERBOSITY_TOKENS_LOWER = tuple(t.lower() for t in MODELS_NOT_SUPPORTING_VERBOSITY)
 
 # OpenAI recommends reserving at least 25,000 tokens for reasoning and outputs
 # https://platform.openai.com/docs/guides/reasoning/how-reasoning-works?reasoning-prompt-examples=research 
 MODEL_SPECIFIC_LIMITS = {"o1": 30000}
 
+# Upper bound on concurrent in-flight OpenAI requests across all chats
+MAX_CONCURRENT_REQUESTS = int(os.environ.get("OPENAI_MAX_CONCURRENCY", "32"))
+
+# Account limits; 0 means learn them from the x-ratelimit-* response headers
+RATE_LIMIT_RPM = int(os.environ.get("OPENAI_RPM_LIMIT", "0"))
+RATE_LIMIT_TPM = int(os.environ.get("OPENAI_TPM_LIMIT", "0"))
+
+# Identical conversations are answered from memory for this many seconds
+RESPONSE_CACHE_TTL_S = int(os.environ.get("OPENAI_CACHE_TTL", "3600"))
+RESPONSE_CACHE_SIZE = 4096
+
+# Router: short, plain questions go to OPENAI_MODEL_SMALL, everything else to the large model
+ROUTER_SMALL_MAX_TOKENS = int(os.environ.get("OPENAI_ROUTER_SMALL_MAX_TOKENS", "60"))
+ROUTER_LARGE_PATTERN = re.compile(
+    r"```|\bdef |\bclass |\bfunction\b|\bselect\b.+\bfrom\b|[=+*/^]\s*\d|"
+    r"\b(code|debug|stack ?trace|regex|sql|equation|integral|derivative|proof|prove|"
+    r"calculate|algorithm|step by step|analy[sz]e|compare|translate|e-?mail|essay)\b",
+    re.IGNORECASE,
+)
+
+# Transient failures are retried with exponential backoff, honoring Retry-After
+RETRY_MAX_ATTEMPTS = 5
+RETRY_MAX_WAIT_S = 30
+TRANSIENT_ERRORS = (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError)
+# Retrying these can't succeed, so they are reported immediately
+PERMANENT_ERRORS = (AuthenticationError, PermissionDeniedError, BadRequestError, NotFoundError)
+
+# Models tried in order when the chosen one keeps failing with transient errors.
+# Opt-in (empty by default), so a deployment pinned to one model never silently
+# switches to another. The chosen model keeps the full retry budget; the
+# fallbacks get fewer retries, so users don't wait long on a dead chain.
+FALLBACK_CHAIN = tuple(
+    m.strip() for m in os.environ.get("OPENAI_FALLBACK_CHAIN", "").split(",") if m.strip()
+)
+FALLBACK_RETRY_ATTEMPTS = 2
+
+# Batch API: half-price, non-interactive jobs completed within 24h
+BATCH_ENDPOINT = "/v1/chat/completions"
+BATCH_COMPLETION_WINDOW = "24h"
+BATCH_POLL_INITIAL_S = 5
+BATCH_POLL_MAX_S = 300
+BATCH_TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
 
 def build_client():
     key = os.environ["OPENAI_API_KEY"]
-    client = OpenAI(api_key=key)
+    # Retries are handled by call_with_retries, so the SDK's own retries are disabled
+    client = AsyncOpenAI(api_key=key, http_client=get_http_client(), max_retries=0)
     return client
 
 
@@ -24,19 +103,89 @@ def build_model_handle():
     return handle
 
 
+def build_router_models():
+    # Routing is enabled only when a small model is configured
+    small = os.environ.get("OPENAI_MODEL_SMALL")
+    large = os.environ.get("OPENAI_MODEL_LARGE", MODEL)
+    return small, large
+
+
 # if os.environ["AI_PROVIDER"] == "openai":
 MODEL = build_model_handle()
+MODEL_SMALL, MODEL_LARGE = build_router_models()
 CLIENT = build_client()
-print(f"Loaded OpenAI model: {MODEL}")
-print(f"Loaded OpenAI client: {CLIENT}")
+logger.info("Loaded OpenAI model: %s", MODEL)
+logger.info("Loaded OpenAI client: %s", CLIENT)
 # else:
 #    MODEL = None
 #    CLIENT = None
 
+REQUEST_SEMAPHORE = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+RATE_LIMITER = RateLimiter(rpm=RATE_LIMIT_RPM, tpm=RATE_LIMIT_TPM)
+
+_RESPONSE_CACHE = TTLCache(maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL_S)
+_RESPONSE_CACHE_LOCK = asyncio.Lock()
+
+# Per-process count of OpenAI failures by error class
+ERROR_COUNTS = Counter()
+
+_exponential_backoff = wait_exponential_jitter(initial=1, max=RETRY_MAX_WAIT_S)
+
+
+def parse_retry_after(exc):
+    response = getattr(exc, "response", None)
+    if response is None:
+        return None
+    value = response.headers.get("retry-after")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def wait_retry_after_or_backoff(retry_state):
+    retry_after = parse_retry_after(retry_state.outcome.exception())
+    if retry_after is not None:
+        return min(retry_after, RETRY_MAX_WAIT_S)
+    return _exponential_backoff(retry_state)
+
+
+async def call_with_retries(create, estimated_tokens, max_attempts=RETRY_MAX_ATTEMPTS, **kwargs):
+    """
+    Call a `with_raw_response` create method under the rate limiter and the
+    concurrency cap, retrying transient errors. The rate limiter is fed from
+    the response headers and usage, and the parsed response is returned.
+    """
+    async for attempt in AsyncRetrying(
+        wait=wait_retry_after_or_backoff,
+        stop=stop_after_attempt(max_attempts),
+        retry=retry_if_exception_type(TRANSIENT_ERRORS),
+        reraise=True,
+    ):
+        with attempt:
+            reserved = 0
+            try:
+                async with RATE_LIMITER.acquire(estimated_tokens) as reserved, REQUEST_SEMAPHORE:
+                    raw = await create(**kwargs)
+            except BaseException as e:
+                # Without rate-limit headers nothing corrects the reservation,
+                # so it is given back rather than left to starve later calls
+                response = getattr(e, "response", None)
+                if not RATE_LIMITER.update_from_headers(getattr(response, "headers", None)):
+                    RATE_LIMITER.refund(reserved)
+                raise
+            RATE_LIMITER.update_from_headers(raw.headers)
+            result = raw.parse()
+            RATE_LIMITER.record_usage(reserved, getattr(result, "usage", None))
+            return result
+
 
 def identify_model_class(model):
-    for model_class in MODEL_CLASSES:
-        if isinstance(model, str) and model_class.lower() in model.lower():
+    if not isinstance(model, str):
+        return None
+    lowered = model.lower()
+    for token, model_class in _MODEL_CLASSES_LOWER:
+        if token in lowered:
             return model_class
     return None
 
@@ -44,10 +193,7 @@ def identify_model_class(model):
 def should_use_legacy_chat_completions(model_name):
     try:
         lowered = model_name.lower() if isinstance(model_name, str) else ""
-        for token in sorted(USE_LEGACY_CHAT_COMPLETIONS_FOR_THESE, key=len, reverse=True):
-            if token.lower() in lowered:
-                return True
-        return False
+        return any(token in lowered for token in _LEGACY_TOKENS_LOWER)
     except Exception:
         return False
 
@@ -55,12 +201,10 @@ def should_use_legacy_chat_completions(model_name):
 def supports_verbosity_param(model_name):
     try:
         lowered = model_name.lower() if isinstance(model_name, str) else ""
-        for token in MODELS_NOT_SUPPORTING_VERBOSITY:
-            if token.lower() in lowered:
-                return False
+        if any(token in lowered for token in _NO_VERBOSITY_TOKENS_LOWER):
+            return False
         # Only apply verbosity to GPT-5 class models
-        model_class = identify_model_class(model_name)
-        return (model_class or "").lower() == "gpt-5"
+        return identify_model_class(model_name) == "gpt-5"
     except Exception:
         return False
 
@@ -76,58 +220,91 @@ def build_verbosity_options(model_name, use_legacy7):
         return {}
 
 
-def sys_msg_conditional_removal(messages):
-    # Create a new list to store modified messages
-    modified_messages = []
-    model_class = identify_model_class(MODEL)
-    
-    for message in messages:
-        if model_class in MODELS_NOT_SUPPORTING_SYS_MSG and message.get("role") == "system":
-            # If the model doesn't support system messages, change role to "assistant"
-            modified_messages.append({"role": "assistant", "content": message.get("content", "")})
-        else:
-            # Otherwise, add the message as-is
-            modified_messages.append(message.copy())
-    
-    # print(f"Messages after conditional removal: {modified_messages}")
-    return modified_messages
+# Responses API part types, interned so dict keys and comparisons hit pointer equality
+_OUT = sys.intern("output_text")
+_IN = sys.intern("input_text")
+_IMG = sys.intern("input_image")
+_TEXT_TYPES = (_OUT, _IN)
 
 
-def convert_messages_to_responses_input(messages):
-    responses_input = []
-    for message in messages:
-        role = message.get("role", "user")
-        content = message.get("content", "")
+def _text_part(item, text_type):
+    return {"type": text_type, "text": item.get("text", "")}
 
-        text_type = "output_text" if role == "assistant" else "input_text"
-        typed_parts = []
 
-        if isinstance(content, str):
-            typed_parts.append({"type": text_type, "text": content})
-        elif isinstance(content, list):
-            for item in content:
-                if not isinstance(item, dict):
-                    typed_parts.append({"type": text_type, "text": str(item)})
-                    continue
-                item_type = item.get("type")
-                if item_type == "text":
-                    typed_parts.append({"type": text_type, "text": item.get("text", "")})
-                elif item_type == "image_url":
-                    image_payload = item.get("image_url")
-                    image_url = None
-                    if isinstance(image_payload, dict):
-                        image_url = image_payload.get("url") or image_payload.get("image_url")
-                    elif isinstance(image_payload, str):
-                        image_url = image_payload
-                    if image_url:
-                        typed_parts.append({"type": "input_image", "image_url": image_url})
-                else:
-                    typed_parts.append({"type": text_type, "text": str(item)})
+def _image_part(item, text_type):
+    image_payload = item.get("image_url")
+    if isinstance(image_payload, dict):
+        image_url = image_payload.get("url") or image_payload.get("image_url")
+    elif isinstance(image_payload, str):
+        image_url = image_payload
+    else:
+        image_url = None
+    if image_url:
+        return {"type": _IMG, "image_url": image_url}
+    return None
+
+
+def _default_part(item, text_type):
+    return {"type": text_type, "text": str(item)}
+
+
+_PART_HANDLERS = {
+    "text": _text_part,
+    "image_url": _image_part,
+}
+
+
+def _convert_part(item, text_type):
+    if not isinstance(item, dict):
+        return _default_part(item, text_type)
+    return _PART_HANDLERS.get(item.get("type"), _default_part)(item, text_type)
+
+
+def _convert_content(content, text_type):
+    if isinstance(content, str):
+        return [{"type": text_type, "text": content}]
+    if isinstance(content, list):
+        return [part for part in (_convert_part(item, text_type) for item in content) if part is not None]
+    return [{"type": text_type, "text": str(content)}]
+
+
+def prepare_input(messages, model=None, typed=None, copy=False):
+    """
+    Build the request messages for a model in a single pass.
+
+    System messages are sent as "assistant" to models that don't accept them
+    and moved to the front, which keeps the request prefix byte-identical
+    across users and turns, so OpenAI's server-side prompt cache can match it.
+    When typed (the default for the Responses API), content is converted into
+    typed input parts. Otherwise messages that need no rewrite are passed
+    through as the original dicts, so callers must treat them as read-only;
+    pass copy=True to get shallow copies instead.
+    """
+    profile = get_model_profile(model or MODEL)
+    if typed is None:
+        typed = not profile.use_legacy
+    rewrite_system = profile.model_class in MODELS_NOT_SUPPORTING_SYS_MSG
+
+    head = []
+    body = []
+    for message in messages:
+        role = message.get("role", "user")
+        target = body
+        if rewrite_system and role == "system":
+            role = "assistant"
+            target = head
+        if typed:
+            text_type = _OUT if role == "assistant" else _IN
+            target.append({"role": role, "content": _convert_content(message.get("content", ""), text_type)})
+        elif target is head:
+            target.append({"role": role, "content": message.get("content", "")})
         else:
-            typed_parts.append({"type": text_type, "text": str(content)})
+            target.append(message.copy() if copy else message)
 
-        responses_input.append({"role": role, "content": typed_parts})
-    return responses_input
+    if head:
+        head.extend(body)
+        return head
+    return body
 
 
 def extract_text_from_responses_output(response):
@@ -137,59 +314,318 @@ def extract_text_from_responses_output(response):
         if isinstance(text, str) and len(text) > 0:
             return text
         # Fallback: traverse structured output
-        output = getattr(response, "output", [])
-        collected = []
-        for block in output or []:
-            for part in block.get("content", []):
-                if part.get("type") in ("output_text", "input_text"):
-                    t = part.get("text")
-                    if isinstance(t, str) and len(t) > 0:
-                        collected.append(t)
-        return "\n".join(collected) if collected else ""
+        output = getattr(response, "output", None)
+        return "\n".join(
+            t
+            for block in output or ()
+            for part in block.get("content", ())
+            if part.get("type") in _TEXT_TYPES and isinstance(t := part.get("text"), str) and t
+        )
     except Exception:
         return ""
 
 
+def build_cache_key(model, messages, max_length):
+    payload = orjson.dumps(messages, option=orjson.OPT_SORT_KEYS)
+    digest = hashlib.blake2b(payload, digest_size=32).hexdigest()
+    return model, digest, max_length
+
+
 def get_max_tokens_arg_name(model_class):
     if (model_class or "").lower() == "o1":
         return "max_output_tokens"
     return "max_completion_tokens"
 
 
-def ask_open_ai(messages, max_length):
-    modified_messages = sys_msg_conditional_removal(messages)
-    answer = ""
-    try:
-        model_class = identify_model_class(MODEL)
-        if model_class in MODEL_SPECIFIC_LIMITS:
-            max_length = MODEL_SPECIFIC_LIMITS[model_class]
-
-        use_legacy7 = should_use_legacy_chat_completions(MODEL)
-        verbosity_opts = build_verbosity_options(MODEL, use_legacy7)
-
-        if use_legacy7:
-            tokens_arg_name = get_max_tokens_arg_name(model_class)
-            kwargs = {**verbosity_opts}
-            if isinstance(max_length, int) and max_length > 0:
-                kwargs[tokens_arg_name] = max_length
-            completion = CLIENT.chat.completions.create(
-                model=MODEL,
-                messages=modified_messages,
-                **kwargs,
+ModelProfile = namedtuple(
+    "ModelProfile",
+    ["model_class", "use_legacy", "supports_verbosity", "tokens_arg", "verbosity_opts", "max_length"],
+)
+
+
+@lru_cache(maxsize=None)
+def get_model_profile(model):
+    """Classify a model once; the handful of configured models never change at runtime."""
+    model_class = identify_model_class(model)
+    use_legacy = should_use_legacy_chat_completions(model)
+    return ModelProfile(
+        model_class=model_class,
+        use_legacy=use_legacy,
+        supports_verbosity=supports_verbosity_param(model),
+        tokens_arg=get_max_tokens_arg_name(model_class),
+        verbosity_opts=build_verbosity_options(model, use_legacy),
+        max_length=MODEL_SPECIFIC_LIMITS.get(model_class),
+    )
+
+
+@lru_cache(maxsize=64)
+def get_legacy_kwargs(model, max_length):
+    """
+    Extra chat-completions arguments for a model and requested length, built
+    once per pair. Callers only unpack the dict, so it is safely shared.
+    """
+    profile = get_model_profile(model)
+    if profile.max_length is not None:
+        max_length = profile.max_length
+    if isinstance(max_length, int) and max_length > 0:
+        return {**profile.verbosity_opts, profile.tokens_arg: max_length}
+    return profile.verbosity_opts
+
+
+# Per-process count of routing decisions by model
+ROUTING_COUNTS = Counter()
+
+
+def get_last_user_text(messages):
+    for message in reversed(messages):
+        if message.get("role") != "user":
+            continue
+        content = message.get("content", "")
+        if isinstance(content, str):
+            return content, False
+        if isinstance(content, list):
+            texts = [p.get("text", "") for p in content if isinstance(p, dict) and p.get("type") == "text"]
+            has_media = any(isinstance(p, dict) and p.get("type") != "text" for p in content)
+            return " ".join(texts), has_media
+        return str(content), False
+    return "", False
+
+
+def choose_model(messages):
+    """
+    Pick the small model for short, plain questions and the large one for
+    anything that looks like code, math, long-form writing or media.
+    Token count is estimated as ~4 characters per token.
+    """
+    if not MODEL_SMALL:
+        return MODEL
+    text, has_media = get_last_user_text(messages)
+    if has_media or ROUTER_LARGE_PATTERN.search(text):
+        model = MODEL_LARGE
+    elif len(text) // 4 <= ROUTER_SMALL_MAX_TOKENS:
+        model = MODEL_SMALL
+    else:
+        model = MODEL_LARGE
+    ROUTING_COUNTS[model] += 1
+    logger.debug("Routed OpenAI request to %s", model)
+    return model
+
+
+@lru_cache(maxsize=None)
+def get_fallback_chain(model):
+    return (model,) + tuple(m for m in FALLBACK_CHAIN if m != model)
+
+
+async def _ask_model(messages, max_length, model, max_attempts):
+    profile = get_model_profile(model)
+    request_messages = prepare_input(messages, model)
+
+    cache_key = build_cache_key(model, request_messages, max_length)
+    async with _RESPONSE_CACHE_LOCK:
+        cached_answer = _RESPONSE_CACHE.get(cache_key)
+    if cached_answer is not None:
+        logger.debug("OpenAI response served from cache")
+        return cached_answer
+
+    if logger.isEnabledFor(logging.DEBUG):
+        payload_chars = sum(len(str(m.get("content", ""))) for m in request_messages)
+        logger.debug("Sending %d messages (%d chars) to %s", len(request_messages), payload_chars, model)
+
+    estimated_tokens = estimate_tokens(request_messages)
+    if profile.use_legacy:
+        completion = await call_with_retries(
+            CLIENT.chat.completions.with_raw_response.create,
+            estimated_tokens,
+            max_attempts,
+            model=model,
+            messages=request_messages,
+            **get_legacy_kwargs(model, max_length),
+        )
+        answer = completion.choices[0].message.content
+    else:
+        response = await call_with_retries(
+            CLIENT.responses.with_raw_response.create,
+            estimated_tokens,
+            max_attempts,
+            model=model,
+            input=request_messages,
+            **profile.verbosity_opts,
+        )
+        answer = extract_text_from_responses_output(response)
+
+    logger.debug("OpenAI response: %s", answer)
+    if answer:
+        async with _RESPONSE_CACHE_LOCK:
+            _RESPONSE_CACHE[cache_key] = answer
+    return answer
+
+
+async def ask_open_ai(messages, max_length, model=None):
+    if model is None:
+        model = choose_model(messages)
+    chain = get_fallback_chain(model)
+    last = len(chain) - 1
+
+    for i, candidate in enumerate(chain):
+        try:
+            return await _ask_model(
+                messages,
+                max_length,
+                candidate,
+                RETRY_MAX_ATTEMPTS if i == 0 else FALLBACK_RETRY_ATTEMPTS,
             )
-            answer = completion.choices[0].message.content
+        except PERMANENT_ERRORS as e:
+            ERROR_COUNTS[type(e).__name__] += 1
+            msg = f"Error while sending to OpenAI: {e}"
+            logger.error(msg)
+            return msg
+        except TRANSIENT_ERRORS as e:
+            ERROR_COUNTS[type(e).__name__] += 1
+            if i == last:
+                # Retries and fallbacks are exhausted; let the caller decide what to do
+                raise
+            logger.warning("OpenAI model %s failed with %s, falling back to %s", candidate, type(e).__name__, chain[i + 1])
+        except Exception as e:
+            ERROR_COUNTS[type(e).__name__] += 1
+            msg = f"Error while sending to OpenAI: {e}"
+            logger.error(msg)
+            return msg
+
+
+async def ask_open_ai_stream(messages, max_length, model=None):
+    """
+    Async generator variant of ask_open_ai that yields text deltas as soon as
+    the model produces them. Cache hits are yielded as a single chunk, and a
+    fully streamed answer is stored in the cache. Streams are not retried,
+    since part of the answer may already have been delivered.
+    """
+    if model is None:
+        model = choose_model(messages)
+    profile = get_model_profile(model)
+    request_messages = prepare_input(messages, model)
+
+    cache_key = build_cache_key(model, request_messages, max_length)
+    async with _RESPONSE_CACHE_LOCK:
+        cached_answer = _RESPONSE_CACHE.get(cache_key)
+    if cached_answer is not None:
+        yield cached_answer
+        return
+
+    collected = []
+    reserved = 0
+    try:
+        async with RATE_LIMITER.acquire(estimate_tokens(request_messages)) as reserved, REQUEST_SEMAPHORE:
+            if profile.use_legacy:
+                stream = await CLIENT.chat.completions.create(
+                    model=model,
+                    messages=request_messages,
+                    stream=True,
+                    **get_legacy_kwargs(model, max_length),
+                )
+                async for chunk in stream:
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if delta:
+                        collected.append(delta)
+                        yield delta
+            else:
+                stream = await CLIENT.responses.create(
+                    model=model,
+                    input=request_messages,
+                    stream=True,
+                    **profile.verbosity_opts,
+                )
+                async for event in stream:
+                    if event.type == "response.output_text.delta" and event.delta:
+                        collected.append(event.delta)
+                        yield event.delta
+    except Exception as e:
+        if not collected:
+            # The stream failed before any output; don't leave its tokens reserved
+            RATE_LIMITER.refund(reserved)
+        ERROR_COUNTS[type(e).__name__] += 1
+        msg = f"Error while sending to OpenAI: {e}"
+        logger.error(msg)
+        yield msg
+        return
+
+    answer = "".join(collected)
+    if answer:
+        async with _RESPONSE_CACHE_LOCK:
+            _RESPONSE_CACHE[cache_key] = answer
+
+
+def build_batch_input(message_threads, max_length):
+    """
+    Build the JSONL payload for the Batch API, one chat completion per thread.
+    Returns the generated custom_ids (in thread order) and the encoded file.
+    """
+    body_opts = build_verbosity_options(MODEL, True)
+    custom_ids = []
+    lines = []
+    for thread in message_threads:
+        custom_id = str(uuid.uuid4())
+        body = {"model": MODEL, "messages": prepare_input(thread, MODEL, typed=False), **body_opts}
+        if isinstance(max_length, int) and max_length > 0:
+            body["max_completion_tokens"] = max_length
+        custom_ids.append(custom_id)
+        lines.append(orjson.dumps(
+            {"custom_id": custom_id, "method": "POST", "url": BATCH_ENDPOINT, "body": body},
+        ))
+    return custom_ids, b"\n".join(lines)
+
+
+def parse_batch_output(output_text):
+    answers_by_id = {}
+    for line in output_text.splitlines():
+        if not line.strip():
+            continue
+        record = orjson.loads(line)
+        response = record.get("response") or {}
+        if response.get("status_code") == 200:
+            answers_by_id[record["custom_id"]] = response["body"]["choices"][0]["message"]["content"]
         else:
-            responses_input = convert_messages_to_responses_input(modified_messages)
-            response = CLIENT.responses.create(
-                model=MODEL,
-                input=responses_input,
-                **verbosity_opts,
-            )
-            answer = extract_text_from_responses_output(response)
+            error = record.get("error") or response.get("body", {}).get("error")
+            answers_by_id[record["custom_id"]] = f"Error while sending to OpenAI: {error}"
+    return answers_by_id
 
-        print(f"OpenAI response: {answer}")
+
+async def ask_open_ai_batch(message_threads, max_length):
+    """
+    Answer several independent conversations through the OpenAI Batch API.
+
+    Meant for offline work (summaries, digests) that can wait up to 24h in
+    exchange for half the price. Returns one answer per thread, in order.
+    """
+    if not message_threads:
+        return []
+
+    custom_ids, batch_input = build_batch_input(message_threads, max_length)
+    try:
+        input_file = await CLIENT.files.create(
+            file=("batch_input.jsonl", batch_input),
+            purpose="batch",
+        )
+        batch = await CLIENT.batches.create(
+            input_file_id=input_file.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window=BATCH_COMPLETION_WINDOW,
+        )
+        logger.info("Created OpenAI batch %s with %d requests", batch.id, len(custom_ids))
+
+        delay = BATCH_POLL_INITIAL_S
+        while batch.status not in BATCH_TERMINAL_STATUSES:
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, BATCH_POLL_MAX_S)
+            batch = await CLIENT.batches.retrieve(batch.id)
+
+        answers_by_id = {}
+        if batch.output_file_id:
+            output = await CLIENT.files.content(batch.output_file_id)
+            answers_by_id = parse_batch_output(output.text)
     except Exception as e:
         msg = f"Error while sending to OpenAI: {e}"
-        print(msg)
-        answer = msg
-    return answer
+        logger.error(msg)
+        return [msg] * len(custom_ids)
+
+    missing = f"Error while sending to OpenAI: batch {batch.id} ended with status {batch.status}"
+    return [answers_by_id.get(custom_id, missing) for custom_id in custom_ids]
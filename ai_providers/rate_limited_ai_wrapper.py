@@ -1,16 +1,66 @@
+import asyncio
+import hashlib
+import logging
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
 from collections import deque
 
+import orjson
+from cachetools import TTLCache
+
 from ai_providers.anthropic_ai_provider import ask_anthropic
 from ai_providers.open_ai_provider import ask_open_ai
 
+logger = logging.getLogger(__name__)
+
 MAX_CALLS_PER_PERIOD = 10000
 PERIOD_S = 60  # 1 min
 
 PROVIDER_FROM_ENV = os.environ["AI_PROVIDER"]
 
+# Threads for blocking provider clients, kept apart from the image-processing
+# pool so slow LLM answers can't starve image work (and vice versa)
+LLM_THREAD_POOL_SIZE = int(os.environ.get("LLM_THREAD_POOL_SIZE", "16"))
+_LLM_EXECUTOR = ThreadPoolExecutor(max_workers=LLM_THREAD_POOL_SIZE, thread_name_prefix="llm")
+
+# Identical text-only conversations are answered from memory for this many
+# seconds (the OpenAI provider keeps its own cache, keyed per model)
+ANTHROPIC_CACHE_TTL_S = int(os.environ.get("ANTHROPIC_CACHE_TTL", "3600"))
+ANTHROPIC_CACHE_SIZE = 4096
+_ANTHROPIC_CACHE = TTLCache(maxsize=ANTHROPIC_CACHE_SIZE, ttl=ANTHROPIC_CACHE_TTL_S)
+
+
+def is_text_only(messages):
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, list) and any(
+            not isinstance(part, dict) or part.get("type") != "text" for part in content
+        ):
+            return False
+    return True
+
+
+def build_cache_key(provider, messages, max_length):
+    payload = orjson.dumps(messages, option=orjson.OPT_SORT_KEYS)
+    return provider, hashlib.blake2b(payload, digest_size=32).digest(), max_length
+
+
+async def ask_anthropic_cached(messages, max_length):
+    cache_key = build_cache_key("anthropic", messages, max_length) if is_text_only(messages) else None
+    if cache_key is not None and (answer := _ANTHROPIC_CACHE.get(cache_key)) is not None:
+        logger.debug("Anthropic response served from cache")
+        return answer
+    # The Anthropic client is synchronous; run it in a worker thread
+    # so a slow answer doesn't stall every other chat
+    answer = await asyncio.get_running_loop().run_in_executor(
+        _LLM_EXECUTOR, ask_anthropic, messages, max_length
+    )
+    if cache_key is not None and answer:
+        _ANTHROPIC_CACHE[cache_key] = answer
+    return answer
+
 
 class RateLimitExceededError(Exception):
     pass
@@ -21,7 +71,7 @@ def rate_limit(max_calls, period, stop_on_limit=True):
     
     def decorator(func):
         @wraps(func)
-        def wrapper(*args, **kwargs):
+        async def wrapper(*args, **kwargs):
             now = time.time()
             
             # Remove calls older than the period
@@ -33,14 +83,14 @@ def rate_limit(max_calls, period, stop_on_limit=True):
                     raise RateLimitExceededError(f"Rate limit of {max_calls} calls per {period} seconds exceeded")
                 else:
                     sleep_time = calls[0] - (now - period)
-                    time.sleep(sleep_time)
+                    await asyncio.sleep(sleep_time)
             
-            result = func(*args, **kwargs)
+            result = await func(*args, **kwargs)
             calls.append(now)
             
-            # Calculate and print the current rate
-            current_rate = len(calls) / period * 60  # Convert to calls per min
-            print(f"Current rate: {current_rate:.2f} calls/min")
+            if logger.isEnabledFor(logging.DEBUG):
+                current_rate = len(calls) / period * 60  # Convert to calls per min
+                logger.debug("Current rate: %.2f calls/min", current_rate)
             
             return result
         return wrapper
@@ -48,26 +98,26 @@ def rate_limit(max_calls, period, stop_on_limit=True):
 
 
 @rate_limit(max_calls=MAX_CALLS_PER_PERIOD, period=PERIOD_S, stop_on_limit=True)
-def ask_gpt_multi_message(messages, max_length, user_defined_provider=None):
+async def ask_gpt_multi_message(messages, max_length, user_defined_provider=None):
     try:
 
         if user_defined_provider is None:
             provider = PROVIDER_FROM_ENV
         else:
             provider = user_defined_provider
-        print(f"Using provider: {provider}")
+        logger.debug("Using provider: %s", provider)
 
         if provider == "openai":
-            answer = ask_open_ai(messages, max_length)
+            answer = await ask_open_ai(messages, max_length)
         elif provider == "anthropic":
-            answer = ask_anthropic(messages, max_length)
+            answer = await ask_anthropic_cached(messages, max_length)
         else:
             answer = f"unknown AI provider: {PROVIDER_FROM_ENV}"
 
-        print(f"AI response: {answer}")
+        logger.debug("AI response: %s", answer)
     except Exception as e:
         msg = f"Error while sending to AI provider: {e}"
-        print(msg)
+        logger.error(msg)
         answer = msg
     return answer
 
@@ -0,0 +1,119 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+
+# Flat charge for each non-text part (images); the length of a base64 data URL
+# says nothing about what the model bills for it
+MEDIA_PART_TOKENS = 1000
+_TEXT_PART_TYPES = frozenset(("text", "input_text", "output_text"))
+
+
+def estimate_tokens(messages):
+    # Cheap proxy: ~4 characters of text per token, good enough to pace requests
+    chars = 0
+    media_parts = 0
+    for m in messages:
+        content = m.get("content", "")
+        if isinstance(content, str):
+            chars += len(content)
+            continue
+        for part in content if isinstance(content, list) else ():
+            if isinstance(part, dict) and part.get("type") in _TEXT_PART_TYPES:
+                chars += len(part.get("text") or "")
+            else:
+                media_parts += 1
+    return chars // 4 + media_parts * MEDIA_PART_TOKENS
+
+
+def _header_number(headers, name):
+    value = headers.get(name)
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class _Bucket:
+    """A token bucket that refills linearly to `capacity` over one minute."""
+
+    def __init__(self, capacity):
+        self.capacity = float(capacity)
+        self.level = float(capacity)
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        if self.capacity > 0:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60.0)
+        self.updated = now
+
+    def wait_time(self, amount):
+        # An unknown limit never throttles; requests larger than the whole
+        # bucket only wait for a full bucket, otherwise they'd wait forever
+        if self.capacity <= 0:
+            return 0.0
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing * 60.0 / self.capacity)
+
+
+class RateLimiter:
+    """
+    Client-side requests-per-minute and tokens-per-minute limiter.
+
+    Both buckets start from the configured limits (0 means unknown) and are
+    corrected from OpenAI's x-ratelimit-* response headers, so the bot paces
+    itself just under the account limits instead of running into 429s.
+    """
+
+    def __init__(self, rpm=0, tpm=0):
+        self.requests = _Bucket(rpm)
+        self.tokens = _Bucket(tpm)
+        self._lock = asyncio.Lock()
+
+    async def _take(self, tokens):
+        # A request larger than the whole bucket only waits for a full bucket,
+        # so it mustn't take more than that either, or the bucket stays empty
+        if self.tokens.capacity > 0:
+            tokens = min(tokens, self.tokens.capacity)
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.requests.refill(now)
+                self.tokens.refill(now)
+                delay = max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+                if delay <= 0:
+                    self.requests.level -= 1
+                    self.tokens.level -= tokens
+                    return tokens
+                await asyncio.sleep(delay)
+
+    @asynccontextmanager
+    async def acquire(self, estimated_tokens):
+        """Wait for room in both buckets; yields the number of tokens reserved."""
+        yield await self._take(estimated_tokens)
+
+    def refund(self, reserved_tokens):
+        # For calls that failed without telling us what was actually used
+        self.tokens.level = min(self.tokens.capacity, self.tokens.level + reserved_tokens)
+
+    def record_usage(self, reserved_tokens, usage):
+        # Give back (or take) the difference between the reservation and the real usage
+        total = getattr(usage, "total_tokens", None) if usage is not None else None
+        if isinstance(total, int):
+            self.tokens.level = min(self.tokens.capacity, self.tokens.level + reserved_tokens - total)
+
+    def update_from_headers(self, headers):
+        """Correct both buckets from x-ratelimit-* headers; True if the token level was reset."""
+        if headers is None:
+            return False
+        token_level_updated = False
+        for bucket, kind in ((self.requests, "requests"), (self.tokens, "tokens")):
+            limit = _header_number(headers, f"x-ratelimit-limit-{kind}")
+            if limit is not None:
+                bucket.capacity = limit
+            remaining = _header_number(headers, f"x-ratelimit-remaining-{kind}")
+            if remaining is not None:
+                bucket.level = min(bucket.capacity, remaining)
+                bucket.updated = time.monotonic()
+                token_level_updated = token_level_updated or bucket is self.tokens
+        return token_level_updated
@@ -1,61 +1,128 @@
+import asyncio
+import atexit
+import importlib.util
+import inspect
+import logging
+import logging.handlers
 import os
+import queue
+import re
+import sys
+import tempfile
+from collections import deque
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+
+# Configured before the providers and plugins are imported, so the messages
+# they log at import time (loaded models, plugins) are visible too.
+# Handlers only enqueue records; a listener thread formats and writes them,
+# so a slow stdout (docker/journald) never stalls the event loop
+_LOG_QUEUE = queue.SimpleQueue()
+_log_console = logging.StreamHandler()
+_log_console.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+_LOG_LISTENER = logging.handlers.QueueListener(_LOG_QUEUE, _log_console)
+_LOG_LISTENER.start()
+atexit.register(_LOG_LISTENER.stop)
+_log_enqueue = logging.handlers.QueueHandler(_LOG_QUEUE)
+# Only merge the message args here; the console handler adds time, level and name
+_log_enqueue.setFormatter(logging.Formatter("%(message)s"))
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(), handlers=[_log_enqueue])
+logger = logging.getLogger(__name__)
+
 from ai_providers.rate_limited_ai_wrapper import (
     PROVIDER_FROM_ENV,
     ask_gpt_multi_message,
 )
+from ai_providers.http_client import aclose_http_client, get_http_client
+from cachetools import TTLCache
+try:
+    from diskcache import FanoutCache  # optional, for HISTORY_DIR
+except ImportError:
+    FanoutCache = None
 from plugins import config_plugins
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
+    AIORateLimiter,
     Application,
     CommandHandler,
     ContextTypes,
     MessageHandler,
     filters,
     CallbackQueryHandler,
+    Defaults,
 )
-from PIL import Image
-import io
-from utils.images import openai_requirements_image_resize, encode_image_to_data_url
-from config import MAX_IMAGES_PER_MESSAGE
-from utils.images import openai_requirements_image_resize, encode_image_to_data_url
+from telegram.request import HTTPXRequest
 from config import MAX_IMAGES_PER_MESSAGE
-import importlib.util
-import sys
+from utils.images import encode_image_to_data_url, open_image, prepare_image_for_openai
+from utils.image_store import ImageStore, expire_refs
+from utils.messages import last_user_parts
 
 # Dynamic Plugin Loading
 PLUGINS = []
+# Plugins bucketed by the message types they declare in SUPPORTED_CONTENT_TYPES;
+# plugins without the attribute are consulted for every type
+CONTENT_TYPES = ("text", "image", "video", "audio")
+PLUGINS_BY_TYPE = {content_type: [] for content_type in CONTENT_TYPES}
 PLUGINS_DIR = os.path.join(os.path.dirname(__file__), "plugins")
+# Imported plugin modules and the mtime of the main.py they were loaded from,
+# so enabling/disabling a plugin only re-executes plugins that changed on disk
+LOADED_MODULES = {}
+_PLUGIN_MTIME = {}
+# Plugins whose is_plugin_applicable takes the shared lowercased message text
+TEXT_LOWER_PLUGINS = set()
 
 def load_plugins():
-    global PLUGINS
+    global PLUGINS, PLUGINS_BY_TYPE, TEXT_LOWER_PLUGINS
     PLUGINS = []
+    PLUGINS_BY_TYPE = {content_type: [] for content_type in CONTENT_TYPES}
+    TEXT_LOWER_PLUGINS = set()
     if not os.path.exists(PLUGINS_DIR):
-        print(f"Plugins directory not found: {PLUGINS_DIR}")
+        logger.warning("Plugins directory not found: %s", PLUGINS_DIR)
         return
 
-    for plugin_name in os.listdir(PLUGINS_DIR):
-        plugin_path = os.path.join(PLUGINS_DIR, plugin_name)
-        if os.path.isdir(plugin_path):
-            # Check if plugin is enabled in config
-            if not config_plugins.is_plugin_enabled(plugin_name):
-                print(f"Plugin {plugin_name} is disabled in config.")
-                continue
-                
-            main_py = os.path.join(plugin_path, "main.py")
-            if os.path.exists(main_py):
-                try:
-                    spec = importlib.util.spec_from_file_location(f"plugins.{plugin_name}", main_py)
-                    module = importlib.util.module_from_spec(spec)
-                    sys.modules[f"plugins.{plugin_name}"] = module
-                    spec.loader.exec_module(module)
-                    
-                    if hasattr(module, "is_plugin_applicable") and hasattr(module, "process_messages"):
-                        PLUGINS.append(module)
-                        print(f"Loaded plugin: {plugin_name}")
-                    else:
-                        print(f"Plugin {plugin_name} missing required functions.")
-                except Exception as e:
-                    print(f"Error loading plugin {plugin_name}: {e}")
+    enabled_plugins = {name for name, enabled in config_plugins.get_plugin_status().items() if enabled}
+
+    # One directory scan; DirEntry.is_dir() reuses the file type from the scan
+    with os.scandir(PLUGINS_DIR) as entries:
+        plugin_dirs = [entry for entry in entries if entry.is_dir()]
+
+    for entry in plugin_dirs:
+        plugin_name = entry.name
+        # Check if plugin is enabled in config
+        if plugin_name not in enabled_plugins:
+            logger.info("Plugin %s is disabled in config.", plugin_name)
+            continue
+
+        main_py = os.path.join(entry.path, "main.py")
+        try:
+            mtime = os.stat(main_py).st_mtime
+        except FileNotFoundError:
+            continue
+        try:
+            module = LOADED_MODULES.get(plugin_name)
+            if module is None or _PLUGIN_MTIME.get(plugin_name) != mtime:
+                spec = importlib.util.spec_from_file_location(f"plugins.{plugin_name}", main_py)
+                module = importlib.util.module_from_spec(spec)
+                sys.modules[f"plugins.{plugin_name}"] = module
+                spec.loader.exec_module(module)
+                LOADED_MODULES[plugin_name] = module
+                _PLUGIN_MTIME[plugin_name] = mtime
+
+            if hasattr(module, "is_plugin_applicable") and hasattr(module, "process_messages"):
+                PLUGINS.append(module)
+                content_types = getattr(module, "SUPPORTED_CONTENT_TYPES", None)
+                for content_type in CONTENT_TYPES if content_types is None else content_types:
+                    PLUGINS_BY_TYPE.setdefault(content_type, []).append(module)
+                if "text_lower" in inspect.signature(module.is_plugin_applicable).parameters:
+                    TEXT_LOWER_PLUGINS.add(module)
+                logger.info("Loaded plugin: %s", plugin_name)
+            else:
+                logger.warning("Plugin %s missing required functions.", plugin_name)
+        except Exception as e:
+            LOADED_MODULES.pop(plugin_name, None)
+            logger.error("Error loading plugin %s: %s", plugin_name, e)
 
 load_plugins()
 
@@ -78,7 +145,17 @@ PROVIDER_INDICATORS = {  # the indicators are case-insensitive
     "anthropic": ["a:", "а:", "c:", "с:"],  # Russian and Latin
 }  # if the user message starts with any of the indicators, use the provider
 
-SELECTED_PROVIDER = None
+# Flat indicator -> provider map, plus one anchored regex over all indicators
+# (longest first, so an indicator never shadows a longer one it prefixes)
+_INDICATOR_TO_PROVIDER = {
+    indicator.lower(): provider
+    for provider, indicators in PROVIDER_INDICATORS.items()
+    for indicator in indicators
+}
+_INDICATOR_RE = re.compile(
+    "|".join(re.escape(indicator) for indicator in sorted(_INDICATOR_TO_PROVIDER, key=len, reverse=True)),
+    re.IGNORECASE,
+)
 
 # Retrieve token from environment variable
 TOKEN = os.getenv("TELEGRAM_LLM_BOT_TOKEN")
@@ -90,8 +167,8 @@ if not TOKEN:
 
 allowed_ids_str = os.getenv("ALLOWED_USER_IDS")
 
-# Convert the string of comma-separated integers to a list of integers
-ALLOWED_USER_IDS = [int(user_id.strip()) for user_id in allowed_ids_str.split(",")]
+# Convert the string of comma-separated integers to a set of integers (O(1) membership checks)
+ALLOWED_USER_IDS = frozenset(int(user_id.strip()) for user_id in allowed_ids_str.split(","))
 
 SYSTEM_MSG = """
 Sie sind ein hilfreicher Assistent.
@@ -101,11 +178,262 @@ Oft ist es hilfreich, dem Benutzer Fragen zu stellen, um ihm einen maßgeschneid
 Aber der Benutzer tippt nicht gerne, also versuchen Sie, unnötige Fragen zu vermeiden. Und es ist besser, eine Frage zu stellen, NACHDEM Sie dem Nutzer bereits geholfen haben, als eine Option zum Weitermachen. 
 Verwenden Sie die Sprache des Benutzers, es sei denn, eine Aufgabe erfordert etwas anderes.
 """
+# Shared by every user's history; nothing downstream may mutate it. A plain dict
+# rather than a MappingProxyType, since orjson and the API clients serialize dicts only
+SYSTEM_MSG_OBJ = {"role": "system", "content": SYSTEM_MSG}
 
 MAX_MESSAGES_NUM = 100
 MAX_IMAGE_SIZE_MB = 30
+# Downloads larger than this are buffered on disk rather than in memory
+IMAGE_SPOOL_MAX_BYTES = 4 * 1024 * 1024
+# Encoded images kept for re-sending with the chat history, across all users
+MAX_IMAGE_BLOBS = 256
+# Conversations kept in memory; the least recently active ones and those idle
+# for longer than MAX_USER_STATE_AGE_S are dropped, so user churn can't grow memory
+MAX_USERS = 10_000
+MAX_USER_STATE_AGE_S = 24 * 60 * 60
+# Turns a user may have in flight (one answering, the rest waiting); messages
+# beyond that get BUSY_MESSAGE and are not added to the history
+MAX_PENDING_TURNS = 2
+BUSY_MESSAGE = "Ich bin noch mit deinen vorherigen Nachrichten beschäftigt, bitte warte kurz und schreib dann nochmal."
+# Threads for image decode/resize/encode, so large uploads don't block the event loop
+IMG_POOL_SIZE = int(os.getenv("IMG_POOL_SIZE", "8"))
+# Threads for plugins' blocking process_messages (page fetches, transcripts),
+# kept apart from the image pool so slow downloads can't starve image work
+PLUGIN_POOL_SIZE = int(os.getenv("PLUGIN_POOL_SIZE", "8"))
+_PLUGIN_EXECUTOR = ThreadPoolExecutor(max_workers=PLUGIN_POOL_SIZE, thread_name_prefix="plugin")
+# Long-poll duration for getUpdates; Telegram holds the request open until an
+# update arrives, so a long poll costs no latency but far fewer round trips
+POLL_TIMEOUT_S = 30
+# Connections for Bot API calls (replies, get_file); HTTP/2 multiplexes them,
+# so a burst of replies shares a few TLS sessions instead of opening one each
+TELEGRAM_POOL_SIZE = 256
+# Times a Bot API call is retried after Telegram answers 429 (RetryAfter)
+TELEGRAM_MAX_RETRIES = 2
+
+
+
+@dataclass
+class UserState:
+    """A user's conversation: the system message plus the last MAX_MESSAGES_NUM messages."""
+    system: dict
+    user_id: int | None = None
+    tail: deque = field(default_factory=lambda: deque(maxlen=MAX_MESSAGES_NUM))
+    # Serializes this user's turns; other users' turns run concurrently
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    # Turns holding or waiting for the lock
+    pending: int = 0
+    # Provider picked with an indicator; None means PROVIDER_FROM_ENV
+    provider: str | None = None
+
+    def messages(self):
+        # The request payload; the deque drops the oldest messages on its own,
+        # and image_ref parts are swapped back for their data URLs
+        return IMAGE_STORE.materialize([self.system, *self.tail])
+
+
+MESSAGES_BY_USER = TTLCache(maxsize=MAX_USERS, ttl=MAX_USER_STATE_AGE_S)
+IMAGE_STORE = ImageStore(MAX_IMAGE_BLOBS)
+
+# Optional on-disk copy of every conversation, so history survives restarts.
+# Images are not persisted: their image_ref parts are saved as EXPIRED_IMAGE_TEXT.
+HISTORY_DIR = os.getenv("HISTORY_DIR")
+HISTORY_STORE = None
+if HISTORY_DIR:
+    if FanoutCache is None:
+        logger.warning("HISTORY_DIR is set but diskcache is not installed; history is kept in memory only.")
+    else:
+        HISTORY_STORE = FanoutCache(HISTORY_DIR, shards=8, size_limit=4 << 30)
+
+
+def get_user_state(user_id):
+    state = MESSAGES_BY_USER.get(user_id)
+    if state is None:
+        state = UserState(system=SYSTEM_MSG_OBJ, user_id=user_id)
+        if HISTORY_STORE is not None:
+            # A single small read, once per user and process
+            saved = HISTORY_STORE.get(user_id)
+            if saved:
+                state.tail.extend(saved["tail"])
+                state.provider = saved["provider"]
+    # Written back on every turn: a TTLCache entry's age counts from its last
+    # write, so only conversations idle for MAX_USER_STATE_AGE_S expire
+    MESSAGES_BY_USER[user_id] = state
+    return state
+
+
+def save_user_state(state, tail):
+    try:
+        HISTORY_STORE.set(
+            state.user_id,
+            {"tail": expire_refs(tail), "provider": state.provider},
+            expire=MAX_USER_STATE_AGE_S,
+        )
+    except Exception as e:
+        # Losing the on-disk copy must not cost the user their answer
+        logger.error("Error saving history for user %s: %s", state.user_id, e)
+
+
+async def ask_in_order(state, user_message):
+    """
+    Append the user's message, ask the LLM and append its answer while holding
+    the user's lock, so two quick messages from one user can't interleave.
+    The caller counts the turn in state.pending (see process_user_turn).
+    """
+    async with state.lock:
+        state.tail.append(user_message)
+        answer = await ask_gpt_multi_message(
+            state.messages(),
+            max_length=500,
+            user_defined_provider=state.provider,
+        )
+        # the deque keeps only the last MAX_MESSAGES_NUM messages
+        state.tail.append({"role": "assistant", "content": answer})
+        if HISTORY_STORE is not None:
+            # Snapshot on the loop, write in a worker; still under the lock,
+            # so a user's saves land in turn order
+            await asyncio.to_thread(save_user_state, state, list(state.tail))
+    return answer
+
+
+class _HistoryView(Sequence):
+    """Read-only view over several message sequences, so plugins can inspect history without a copy."""
+    __slots__ = ("_segments",)
+
+    def __init__(self, *segments):
+        self._segments = segments
+
+    def __len__(self):
+        return sum(len(segment) for segment in self._segments)
+
+    def __iter__(self):
+        for segment in self._segments:
+            yield from segment
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self)[index]
+        if index < 0:
+            index += len(self)
+        if index >= 0:
+            for segment in self._segments:
+                if index < len(segment):
+                    return segment[index]
+                index -= len(segment)
+        raise IndexError("history index out of range")
+
+
+def last_message_text_lower(messages):
+    """The newest user message's text parts, joined by spaces and lowercased."""
+    text, _, _ = last_user_parts(messages)
+    return text.lower() if text else ""
+
+
+def _checks_inline(plugin):
+    check = plugin.is_plugin_applicable
+    return inspect.iscoroutinefunction(check) or getattr(plugin, "FAST_APPLICABILITY", False)
+
+
+async def _check_applicable(plugin, messages, snapshot, provider, text_lower):
+    check = plugin.is_plugin_applicable
+    kwargs = {"text_lower": text_lower} if plugin in TEXT_LOWER_PLUGINS else {}
+    if inspect.iscoroutinefunction(check):
+        return await check(messages, provider, **kwargs)
+    if getattr(plugin, "FAST_APPLICABILITY", False):
+        # Cheap predicates run inline; a thread hop would cost more than the check
+        return check(messages, provider, **kwargs)
+    # The view wraps the live history, which the loop may append to meanwhile,
+    # so worker threads get a copy
+    return await asyncio.to_thread(check, snapshot, provider, **kwargs)
+
+
+async def run_plugin(plugin, messages, provider):
+    """
+    Run a plugin's process_messages without blocking the event loop: async
+    plugins are awaited, plain ones (network fetches, transcripts) run on the
+    plugin pool so other users' messages keep flowing meanwhile.
+    """
+    process = plugin.process_messages
+    if inspect.iscoroutinefunction(process):
+        return await process(messages, provider)
+    return await asyncio.get_running_loop().run_in_executor(_PLUGIN_EXECUTOR, process, messages, provider)
+
+
+async def applicable_plugins(plugins, messages, provider):
+    """
+    Run every plugin's is_plugin_applicable concurrently and return the
+    applicable plugins in load order, so the first one still takes priority.
+    The message text is extracted and lowercased once for all plugins that take it.
+    """
+    text_lower = None
+    if any(plugin in TEXT_LOWER_PLUGINS for plugin in plugins):
+        text_lower = last_message_text_lower(messages)
+    # One copy, taken on the loop, shared by all checks that run in threads
+    snapshot = None if all(_checks_inline(plugin) for plugin in plugins) else list(messages)
+    results = await asyncio.gather(
+        *(_check_applicable(plugin, messages, snapshot, provider, text_lower) for plugin in plugins),
+        return_exceptions=True,
+    )
+    applicable = []
+    for plugin, result in zip(plugins, results):
+        if isinstance(result, Exception):
+            logger.error("Error executing plugin %s: %s", plugin.__name__, result)
+        elif result:
+            applicable.append(plugin)
+    return applicable
+
+
+def history_with(state, new_message):
+    """The user's history followed by `new_message`, as a read-only view for plugins."""
+    return _HistoryView((state.system,), state.tail, (new_message,))
+
+
+def _process_image_sync(fp, fmt: str) -> tuple[str, tuple[int, int], tuple[int, int]]:
+    """Decode, resize to OpenAI requirements and encode a downloaded image; runs in a worker thread."""
+    fp.seek(0)
+    img = open_image(fp)
+    original_size = img.size
+    img_resized = prepare_image_for_openai(img)
+    return encode_image_to_data_url(img_resized, fmt=fmt), original_size, img_resized.size
+
+
+async def download_to_memory_capped(file, out, max_size_mb: int) -> None:
+    """
+    Stream a Telegram file into `out`, stopping as soon as it grows past
+    max_size_mb, so oversized uploads are never buffered in full.
+    Callers still check the size of `out` afterwards.
+    """
+    if not str(file.file_path).startswith(("http://", "https://")):
+        # Not a URL (e.g. a local Bot API server); let PTB resolve it
+        await file.download_to_memory(out=out)
+        return
+    max_bytes = max_size_mb * 1024 * 1024
+    async with get_http_client().stream("GET", file.file_path) as resp:
+        resp.raise_for_status()
+        async for chunk in resp.aiter_bytes():
+            out.write(chunk)
+            if out.tell() > max_bytes:
+                break
+
+
+@asynccontextmanager
+async def downloaded_file(file, max_size_mb: int):
+    """
+    Yield a binary file with the Telegram file's bytes, positioned at the end
+    so tell() is its size. A local Bot API server's file is read in place;
+    anything else is downloaded into a spooled temp file (small files stay in
+    memory, large ones spill to disk), stopping just past max_size_mb.
+    """
+    local_path = str(file.file_path).removeprefix("file://")
+    if os.path.isfile(local_path):
+        with open(local_path, "rb") as fp:
+            fp.seek(0, os.SEEK_END)
+            yield fp
+        return
+    with tempfile.SpooledTemporaryFile(max_size=IMAGE_SPOOL_MAX_BYTES) as buf:
+        await download_to_memory_capped(file, buf, max_size_mb)
+        yield buf
 
-MESSAGES_BY_USER = {}
 
 def is_file_too_large(file_size_bytes: int | None, max_size_mb: int) -> bool:
     try:
@@ -115,7 +443,7 @@ def is_file_too_large(file_size_bytes: int | None, max_size_mb: int) -> bool:
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    print("In the start function...")
+    logger.debug("In the start function...")
 
     user = update.effective_user
 
@@ -224,363 +552,253 @@ async def disable_all_plugins_cmd(update: Update, context: ContextTypes.DEFAULT_
     await update.message.reply_text("❌ All plugins disabled.")
 
 
-def update_provider_from_user_input(user_input):
+def strip_indicator(user_input):
+    """Return the message without its provider indicator, and the indicated provider (or None)."""
+    match = _INDICATOR_RE.match(user_input)
+    if match is None:
+        return user_input, None
+    return user_input[match.end():].strip(), _INDICATOR_TO_PROVIDER[match.group().lower()]
+
+
+def update_provider_from_user_input(state, user_input):
+    """
+    Switch the user's provider if the message starts with an indicator.
+    Returns (switched, report, the message without the indicator).
+    """
     switch7 = False
     report = ""
-    for provider, indicators in PROVIDER_INDICATORS.items():
-        for indicator in indicators:
-            if user_input.lower().startswith(indicator):
-                global SELECTED_PROVIDER
-                if provider != SELECTED_PROVIDER:
-                    switch7 = True
-                    if SELECTED_PROVIDER is None:
-                        SELECTED_PROVIDER = PROVIDER_FROM_ENV
-                    report = f"{SELECTED_PROVIDER} -> {provider}"
-                    print(report)
-                SELECTED_PROVIDER = provider
-                return switch7, report
-    return switch7, report
+    stripped, provider = strip_indicator(user_input)
+    if provider is not None:
+        if provider != state.provider:
+            switch7 = True
+            report = f"{state.provider or PROVIDER_FROM_ENV} -> {provider}"
+            logger.info("Provider switched: %s", report)
+        state.provider = provider
+    return switch7, report, stripped
+
+
+async def process_user_turn(
+    update: Update, user_id: int, content_type: str, text: str, media_part=None, run_plugins=True
+) -> None:
+    """
+    The part every message handler shares: switch the provider if `text` starts
+    with an indicator, let the plugins for `content_type` rework the message
+    (unless `run_plugins` is False), ask the LLM and reply. `media_part` is the
+    message's image/video/audio content part, if any; `text` is then its caption.
+    A burst beyond MAX_PENDING_TURNS is answered with BUSY_MESSAGE before any
+    plugin or image-store work, instead of piling every message into the
+    context of the turns still waiting.
+    """
+    reply = update.message.reply_text
+    state = get_user_state(user_id)
+    if state.pending >= MAX_PENDING_TURNS:
+        logger.info("Dropping a message from a busy conversation (%d turns pending)", state.pending)
+        await reply(BUSY_MESSAGE)
+        return
+    state.pending += 1
+    try:
+        answer = await _process_counted_turn(update, state, content_type, text, media_part, run_plugins)
+    finally:
+        state.pending -= 1
+    await reply(answer)
+
+
+async def _process_counted_turn(update, state, content_type, text, media_part, run_plugins):
+    reply = update.message.reply_text
+    # get the provider from the user input, and remove the provider indicator
+    # from the start of the message, but only from the start
+    switch7, report, text = update_provider_from_user_input(state, text)
+    if switch7:
+        await reply(report)
+
+    if media_part is None:
+        content = text
+    else:
+        content = [{"type": "text", "text": text}, media_part] if text else [media_part]
+    user_message = {"role": "user", "content": content}
+
+    # Read-only view of the history plus the current message; plugins that
+    # fire get their own list to modify
+    temp_messages = history_with(state, user_message)
+    # Pass the user's provider to the plugins, defaulting to env
+    current_provider = state.provider or PROVIDER_FROM_ENV
+
+    final_message = user_message
+    plugins = PLUGINS_BY_TYPE[content_type] if run_plugins else []
+    for plugin in await applicable_plugins(plugins, temp_messages, current_provider):
+        try:
+            logger.info("Plugin %s triggered.", plugin.__name__)
+            # Plugins rewrite the last message's content (often in place), so
+            # compare against the content as it was before the plugin ran
+            updated_messages = await run_plugin(plugin, list(temp_messages), current_provider)
+            if updated_messages and updated_messages[-1]["content"] != content:
+                final_message = updated_messages[-1]
+                await reply(f"Processed by plugin: {plugin.__name__.split('.')[-1]}")
+                break  # the first plugin that changes the message wins
+        except Exception as e:
+            logger.error("Error executing plugin %s: %s", plugin.__name__, e)
+
+    answer = await ask_in_order(state, IMAGE_STORE.stash(final_message))
+    logger.debug("Messages length: %d", len(state.tail) + 1)
+    return answer
 
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    print("In the handle_message function...")
+    logger.debug("In the handle_message function...")
     user_id = update.effective_user.id
+    message = update.message
 
     if user_id in ALLOWED_USER_IDS:
-        user_input = update.message.text
-        user_input = user_input.strip()
-        print(f"User input: {user_input}")
-
-        # get the provider from the user input
-        switch7, report = update_provider_from_user_input(user_input)
-        if switch7:
-            await update.message.reply_text(report)
-
-        # remove the provider indicator from the start of the message, but only from the start
-        for provider, indicators in PROVIDER_INDICATORS.items():
-            for indicator in indicators:
-                if user_input.lower().startswith(indicator):
-                    user_input = user_input[len(indicator) :].strip()
-
-        # Plugin processing
-        # Create a temporary message list to pass to plugins
-        # We need to construct it as if it was in the history, but it's just the current message for now
-        # Actually, plugins might need history? The spec says `is_plugin_applicable(messages)`.
-        # So we should pass the current history + the new message?
-        # But we haven't appended the new message to history yet.
-        # Let's construct a temporary list.
-        
-        temp_messages = []
-        if user_id in MESSAGES_BY_USER:
-            temp_messages = MESSAGES_BY_USER[user_id].copy()
-        
-        # Append current message
-        temp_messages.append({"role": "user", "content": user_input})
-        
-        plugin_processed = False
-        user_input_to_process = user_input
-        
-        for plugin in PLUGINS:
-            try:
-                # Pass the selected provider to the plugin
-                # The provider might be None if not set yet, defaulting to env
-                current_provider = SELECTED_PROVIDER if SELECTED_PROVIDER else PROVIDER_FROM_ENV
-                
-                if plugin.is_plugin_applicable(temp_messages, current_provider):
-                    print(f"Plugin {plugin.__name__} triggered.")
-                    # process_messages modifies the messages list in place or returns it?
-                    # The spec says "Modifies the messages accordingly".
-                    # Let's assume it modifies the last message content if needed.
-                    # We should pass a copy or the actual list?
-                    # If we pass temp_messages, we can check if the last message content changed.
-                    
-                    # We need to be careful. If we pass temp_messages and it modifies it, 
-                    # we extract the content from the last message.
-                    
-                    # we extract the content from the last message.
-                    
-                    updated_messages = plugin.process_messages(temp_messages, current_provider)
-                    if updated_messages:
-                        last_msg = updated_messages[-1]
-                        if last_msg["content"] != user_input:
-                            user_input_to_process = last_msg["content"]
-                            plugin_processed = True
-                            await update.message.reply_text(f"Processed by plugin: {plugin.__name__.split('.')[-1]}")
-                            break # Stop after first plugin triggers?
-            except Exception as e:
-                print(f"Error executing plugin {plugin.__name__}: {e}")
-
-        # If no plugin processed it, user_input_to_process remains user_input
-
-        if user_id in MESSAGES_BY_USER:
-            MESSAGES_BY_USER[user_id].append(
-                {"role": "user", "content": user_input_to_process},
-            )
-
-        else:  # the user posted his first message
-            MESSAGES_BY_USER[user_id] = [
-                {"role": "system", "content": SYSTEM_MSG},
-                {"role": "user", "content": user_input_to_process},
-            ]
-
-        # answer = ask_gpt_single_message(user_input, SYSTEM_MSG, max_length=500)
-        answer = ask_gpt_multi_message(
-            MESSAGES_BY_USER[user_id],
-            max_length=500,
-            user_defined_provider=SELECTED_PROVIDER,
-        )
-
-        MESSAGES_BY_USER[user_id].append(
-            {"role": "assistant", "content": answer},
-        )
-
-        # remove the oldest messages. We keep only the last MAX_MESSAGES_NUM messages
-        if len(MESSAGES_BY_USER[user_id]) > MAX_MESSAGES_NUM:
-            MESSAGES_BY_USER[user_id] = MESSAGES_BY_USER[user_id][-MAX_MESSAGES_NUM:]
-            # attach the system message to the beginning
-            MESSAGES_BY_USER[user_id].insert(
-                0, {"role": "system", "content": SYSTEM_MSG}
-            )
-        print(f"Messages length: {len(MESSAGES_BY_USER[user_id])}")
-
-        await update.message.reply_text(answer)
+        user_input = message.text.strip()
+        logger.debug("User input: %s", user_input)
+        await process_user_turn(update, user_id, "text", user_input)
     else:
         answer = f"Eh? Du hast doch keine Berechtigung. Deine user_id ist {user_id}."
-        print(answer)
-        await update.message.reply_text(answer)
+        logger.warning(answer)
+        await message.reply_text(answer)
 
 
 async def handle_photo_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    print("In the handle_photo_message function...")
+    logger.debug("In the handle_photo_message function...")
     user_id = update.effective_user.id
+    message = update.message
 
     if user_id in ALLOWED_USER_IDS:
         try:
             # Reject media groups (albums) when only 1 image per message is allowed
-            if update.message.media_group_id is not None and MAX_IMAGES_PER_MESSAGE == 1:
+            if message.media_group_id is not None and MAX_IMAGES_PER_MESSAGE == 1:
                 msg = f"Too many images in one message (album). Allowed: {MAX_IMAGES_PER_MESSAGE}."
-                print(msg)
-                await update.message.reply_text(msg)
+                logger.info(msg)
+                await message.reply_text(msg)
                 return
-            photos = update.message.photo
+            photos = message.photo
             if not photos:
-                await update.message.reply_text("got an image")
+                await message.reply_text("got an image")
                 return
             # Debug: Telegram PhotoSize reported size
             reported_photo_size = getattr(photos[-1], "file_size", None)
-            print(f"DEBUG(photo): PhotoSize.file_size={reported_photo_size} bytes")
+            logger.debug("DEBUG(photo): PhotoSize.file_size=%s bytes", reported_photo_size)
             # Pre-check size (Telegram photo sizes are server-compressed, so we also check post-download size below)
             if is_file_too_large(getattr(photos[-1], "file_size", None), MAX_IMAGE_SIZE_MB):
                 msg = f"File size exceeds the maximum limit of {MAX_IMAGE_SIZE_MB}MB. Please send a smaller image."
-                print(msg)
-                await update.message.reply_text(msg)
+                logger.info(msg)
+                await message.reply_text(msg)
                 return
 
             file_id = photos[-1].file_id
             file = await context.bot.get_file(file_id)
             # Debug: Telegram File reported size
             reported_file_size = getattr(file, "file_size", None)
-            print(f"DEBUG(photo): File.file_size={reported_file_size} bytes")
+            logger.debug("DEBUG(photo): File.file_size=%s bytes", reported_file_size)
             if is_file_too_large(getattr(file, "file_size", None), MAX_IMAGE_SIZE_MB):
                 msg = f"File size exceeds the maximum limit of {MAX_IMAGE_SIZE_MB}MB. Please send a smaller image."
-                print(msg)
-                await update.message.reply_text(msg)
-                return
-
-            bio = io.BytesIO()
-            await file.download_to_memory(out=bio)
-            # Post-download size check (definitive)
-            bytes_len = bio.getbuffer().nbytes
-            print(f"DEBUG(photo): downloaded bytes_len={bytes_len} bytes (~{bytes_len/1024/1024:.2f} MB)")
-            if is_file_too_large(bytes_len, MAX_IMAGE_SIZE_MB):
-                msg = f"File size exceeds the maximum limit of {MAX_IMAGE_SIZE_MB}MB. Please send a smaller image."
-                print(msg)
-                await update.message.reply_text(msg)
+                logger.info(msg)
+                await message.reply_text(msg)
                 return
-            bio.seek(0)
-            img = Image.open(bio)
-            w, h = img.size
-            print(f"DEBUG(photo): original downloaded image size={w}x{h}")
 
-            # Resize to OpenAI requirements and encode
-            img_resized = openai_requirements_image_resize(img)
-            rw, rh = img_resized.size
-            print(f"DEBUG(photo): resized image size={rw}x{rh}")
-            data_url = encode_image_to_data_url(img_resized, fmt="JPEG")
+            async with downloaded_file(file, MAX_IMAGE_SIZE_MB) as buf:
+                # Post-download size check (definitive; the download stops just past the limit)
+                bytes_len = buf.tell()  # the download leaves the position at the end
+                logger.debug("DEBUG(photo): downloaded bytes_len=%d bytes (~%.2f MB)", bytes_len, bytes_len / 1024 / 1024)
+                if is_file_too_large(bytes_len, MAX_IMAGE_SIZE_MB):
+                    msg = f"File size exceeds the maximum limit of {MAX_IMAGE_SIZE_MB}MB. Please send a smaller image."
+                    logger.info(msg)
+                    await message.reply_text(msg)
+                    return
+                # Resize to OpenAI requirements and encode, off the event loop
+                data_url, (w, h), (rw, rh) = await asyncio.to_thread(_process_image_sync, buf, "JPEG")
+            logger.debug("DEBUG(photo): original downloaded image size=%dx%d", w, h)
+            logger.debug("DEBUG(photo): resized image size=%dx%d", rw, rh)
 
             image_content = {"type": "image_url", "image_url": {"url": data_url}}
-            content_parts = []
-            if isinstance(update.message.caption, str) and len(update.message.caption.strip()) > 0:
-                print(f"DEBUG(photo): caption_len={len(update.message.caption.strip())}")
-                content_parts.append({"type": "text", "text": update.message.caption.strip()})
-            content_parts.append(image_content)
-
-            user_input = update.message.caption or ""
-            
-            # Provider update logic
-            switch7, report = update_provider_from_user_input(user_input)
-            if switch7:
-                await update.message.reply_text(report)
-            
-            # Strip indicator
-            for provider, indicators in PROVIDER_INDICATORS.items():
-                for indicator in indicators:
-                    if user_input.lower().startswith(indicator):
-                        user_input = user_input[len(indicator) :].strip()
-
-            # Temp messages for plugins
-            temp_messages = []
-            if user_id in MESSAGES_BY_USER:
-                temp_messages = MESSAGES_BY_USER[user_id].copy()
-            
-            temp_messages.append({"role": "user", "content": content_parts})
-            
-            plugin_processed = False
-            current_provider = SELECTED_PROVIDER if SELECTED_PROVIDER else PROVIDER_FROM_ENV
-            final_messages = temp_messages # Default
-            
-            for plugin in PLUGINS:
-                try:
-                    if plugin.is_plugin_applicable(temp_messages, current_provider):
-                        print(f"Plugin {plugin.__name__} triggered.")
-                        updated_messages = plugin.process_messages(temp_messages, current_provider)
-                        if updated_messages:
-                            final_messages = updated_messages
-                            plugin_processed = True
-                            await update.message.reply_text(f"Processed by plugin: {plugin.__name__.split('.')[-1]}")
-                            break 
-                except Exception as e:
-                    print(f"Error executing plugin {plugin.__name__}: {e}")
-
-            if user_id in MESSAGES_BY_USER:
-                MESSAGES_BY_USER[user_id].append(final_messages[-1])
-            else:
-                MESSAGES_BY_USER[user_id] = [
-                    {"role": "system", "content": SYSTEM_MSG},
-                    final_messages[-1],
-                ]
-
-            answer = ask_gpt_multi_message(
-                MESSAGES_BY_USER[user_id],
-                max_length=500,
-                user_defined_provider=SELECTED_PROVIDER,
-            )
-
-            MESSAGES_BY_USER[user_id].append({"role": "assistant", "content": answer})
-            if len(MESSAGES_BY_USER[user_id]) > MAX_MESSAGES_NUM:
-                MESSAGES_BY_USER[user_id] = MESSAGES_BY_USER[user_id][-MAX_MESSAGES_NUM:]
-                MESSAGES_BY_USER[user_id].insert(0, {"role": "system", "content": SYSTEM_MSG})
-
-            await update.message.reply_text(answer)
+            await process_user_turn(update, user_id, "image", (message.caption or "").strip(), image_content)
         except Exception as e:
-            print(f"Error handling photo: {e}")
-            await update.message.reply_text("Sorry, failed to process the image.")
+            logger.error("Error handling photo: %s", e)
+            await message.reply_text("Sorry, failed to process the image.")
     else:
         answer = f"Eh? Du hast doch keine Berechtigung. Deine user_id ist {user_id}."
-        print(answer)
-        await update.message.reply_text(answer)
+        logger.warning(answer)
+        await message.reply_text(answer)
 
 async def handle_image_document_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    print("In the handle_image_document_message function...")
+    logger.debug("In the handle_image_document_message function...")
     user_id = update.effective_user.id
+    message = update.message
 
     if user_id in ALLOWED_USER_IDS:
         try:
             # Reject media groups (albums) for documents as well when limit is 1
-            if update.message.media_group_id is not None and MAX_IMAGES_PER_MESSAGE == 1:
+            if message.media_group_id is not None and MAX_IMAGES_PER_MESSAGE == 1:
                 msg = f"Too many images in one message (album). Allowed: {MAX_IMAGES_PER_MESSAGE}."
-                print(msg)
-                await update.message.reply_text(msg)
+                logger.info(msg)
+                await message.reply_text(msg)
                 return
-            doc = update.message.document
+            doc = message.document
             if not doc or not isinstance(doc.mime_type, str) or not doc.mime_type.startswith("image/"):
                 return
-            print(f"DEBUG(doc): name={getattr(doc, 'file_name', None)}, mime={doc.mime_type}, file_size={getattr(doc, 'file_size', None)} bytes")
+            # Decided before get_file, so a disabled plugin costs no download
+            if not config_plugins.is_plugin_enabled("watch_picture"):
+                await message.reply_text("Image handling is disabled.")
+                return
+            logger.debug("DEBUG(doc): name=%s, mime=%s, file_size=%s bytes", getattr(doc, "file_name", None), doc.mime_type, getattr(doc, "file_size", None))
             # Pre-check size on the document (original size preserved for documents)
             if is_file_too_large(getattr(doc, "file_size", None), MAX_IMAGE_SIZE_MB):
                 msg = f"File size exceeds the maximum limit of {MAX_IMAGE_SIZE_MB}MB. Please send a smaller image."
-                print(msg)
-                await update.message.reply_text(msg)
+                logger.info(msg)
+                await message.reply_text(msg)
                 return
 
             file = await context.bot.get_file(doc.file_id)
-            print(f"DEBUG(doc): File.file_size={getattr(file, 'file_size', None)} bytes")
+            logger.debug("DEBUG(doc): File.file_size=%s bytes", getattr(file, "file_size", None))
             if is_file_too_large(getattr(file, "file_size", None), MAX_IMAGE_SIZE_MB):
                 msg = f"File size exceeds the maximum limit of {MAX_IMAGE_SIZE_MB}MB. Please send a smaller image."
-                print(msg)
-                await update.message.reply_text(msg)
+                logger.info(msg)
+                await message.reply_text(msg)
                 return
 
-            bio = io.BytesIO()
-            await file.download_to_memory(out=bio)
-            bytes_len = bio.getbuffer().nbytes
-            print(f"DEBUG(doc): downloaded bytes_len={bytes_len} bytes (~{bytes_len/1024/1024:.2f} MB)")
-            if is_file_too_large(bytes_len, MAX_IMAGE_SIZE_MB):
-                msg = f"File size exceeds the maximum limit of {MAX_IMAGE_SIZE_MB}MB. Please send a smaller image."
-                print(msg)
-                await update.message.reply_text(msg)
-                return
-            bio.seek(0)
-            img = Image.open(bio)
-            w, h = img.size
-            print(f"DEBUG(doc): original downloaded image size={w}x{h}")
-
-            img_resized = openai_requirements_image_resize(img)
-            rw, rh = img_resized.size
-            print(f"DEBUG(doc): resized image size={rw}x{rh}")
-            # Preserve format when reasonable, default to JPEG
-            fmt = "JPEG"
-            if isinstance(doc.mime_type, str) and "png" in doc.mime_type:
-                fmt = "PNG"
-            data_url = encode_image_to_data_url(img_resized, fmt=fmt)
+            async with downloaded_file(file, MAX_IMAGE_SIZE_MB) as buf:
+                bytes_len = buf.tell()  # the download leaves the position at the end
+                logger.debug("DEBUG(doc): downloaded bytes_len=%d bytes (~%.2f MB)", bytes_len, bytes_len / 1024 / 1024)
+                if is_file_too_large(bytes_len, MAX_IMAGE_SIZE_MB):
+                    msg = f"File size exceeds the maximum limit of {MAX_IMAGE_SIZE_MB}MB. Please send a smaller image."
+                    logger.info(msg)
+                    await message.reply_text(msg)
+                    return
+                # Preserve format when reasonable, default to JPEG
+                fmt = "JPEG"
+                if isinstance(doc.mime_type, str) and "png" in doc.mime_type:
+                    fmt = "PNG"
+                data_url, (w, h), (rw, rh) = await asyncio.to_thread(_process_image_sync, buf, fmt)
+            logger.debug("DEBUG(doc): original downloaded image size=%dx%d", w, h)
+            logger.debug("DEBUG(doc): resized image size=%dx%d", rw, rh)
 
             image_content = {"type": "image_url", "image_url": {"url": data_url}}
-            content_parts = []
-            if isinstance(update.message.caption, str) and len(update.message.caption.strip()) > 0:
-                print(f"DEBUG(doc): caption_len={len(update.message.caption.strip())}")
-                content_parts.append({"type": "text", "text": update.message.caption.strip()})
-            content_parts.append(image_content)
-
-            if user_id in MESSAGES_BY_USER:
-                MESSAGES_BY_USER[user_id].append({"role": "user", "content": content_parts})
-            else:
-                MESSAGES_BY_USER[user_id] = [
-                    {"role": "system", "content": SYSTEM_MSG},
-                    {"role": "user", "content": content_parts},
-                ]
-
-            answer = ask_gpt_multi_message(
-                MESSAGES_BY_USER[user_id],
-                max_length=500,
-                user_defined_provider=SELECTED_PROVIDER,
+            # Image documents never went through the plugins; kept that way
+            # until plugin dispatch for them is covered by tests
+            await process_user_turn(
+                update, user_id, "image", (message.caption or "").strip(), image_content, run_plugins=False
             )
-
-            MESSAGES_BY_USER[user_id].append({"role": "assistant", "content": answer})
-            if len(MESSAGES_BY_USER[user_id]) > MAX_MESSAGES_NUM:
-                MESSAGES_BY_USER[user_id] = MESSAGES_BY_USER[user_id][-MAX_MESSAGES_NUM:]
-                MESSAGES_BY_USER[user_id].insert(0, {"role": "system", "content": SYSTEM_MSG})
-
-            await update.message.reply_text(answer)
         except Exception as e:
-            print(f"Error handling image document: {e}")
-            await update.message.reply_text("Sorry, failed to process the image document.")
+            logger.error("Error handling image document: %s", e)
+            await message.reply_text("Sorry, failed to process the image document.")
     else:
         answer = f"Eh? Du hast doch keine Berechtigung. Deine user_id ist {user_id}."
-        print(answer)
-        await update.message.reply_text(answer)
+        logger.warning(answer)
+        await message.reply_text(answer)
 
 
 async def handle_video_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    print("In the handle_video_message function...")
+    logger.debug("In the handle_video_message function...")
     user_id = update.effective_user.id
+    message = update.message
 
     if user_id in ALLOWED_USER_IDS:
         try:
-            video = update.message.video
+            video = message.video
             if not video:
                 return
             
-            print(f"DEBUG(video): file_id={video.file_id}, mime={video.mime_type}, size={video.file_size}")
+            logger.debug("DEBUG(video): file_id=%s, mime=%s, size=%s", video.file_id, video.mime_type, video.file_size)
             
             video_content = {
                 "type": "video", 
@@ -590,92 +808,35 @@ async def handle_video_message(update: Update, context: ContextTypes.DEFAULT_TYP
                 "file_name": getattr(video, "file_name", "video.mp4")
             }
             
-            content_parts = []
-            if isinstance(update.message.caption, str) and len(update.message.caption.strip()) > 0:
-                content_parts.append({"type": "text", "text": update.message.caption.strip()})
-            content_parts.append(video_content)
-            
-            user_input = update.message.caption or ""
-            
-            # Provider update logic
-            switch7, report = update_provider_from_user_input(user_input)
-            if switch7:
-                await update.message.reply_text(report)
-            
-            # Strip indicator
-            for provider, indicators in PROVIDER_INDICATORS.items():
-                for indicator in indicators:
-                    if user_input.lower().startswith(indicator):
-                        user_input = user_input[len(indicator) :].strip()
-
-            # Temp messages for plugins
-            temp_messages = []
-            if user_id in MESSAGES_BY_USER:
-                temp_messages = MESSAGES_BY_USER[user_id].copy()
-            
-            temp_messages.append({"role": "user", "content": content_parts})
-            
-            plugin_processed = False
-            current_provider = SELECTED_PROVIDER if SELECTED_PROVIDER else PROVIDER_FROM_ENV
-            final_messages = temp_messages # Default
-            
-            for plugin in PLUGINS:
-                try:
-                    if plugin.is_plugin_applicable(temp_messages, current_provider):
-                        print(f"Plugin {plugin.__name__} triggered.")
-                        updated_messages = plugin.process_messages(temp_messages, current_provider)
-                        if updated_messages:
-                            final_messages = updated_messages
-                            plugin_processed = True
-                            await update.message.reply_text(f"Processed by plugin: {plugin.__name__.split('.')[-1]}")
-                            break 
-                except Exception as e:
-                    print(f"Error executing plugin {plugin.__name__}: {e}")
-            
-            if user_id in MESSAGES_BY_USER:
-                MESSAGES_BY_USER[user_id].append(final_messages[-1])
-            else:
-                MESSAGES_BY_USER[user_id] = [
-                    {"role": "system", "content": SYSTEM_MSG},
-                    final_messages[-1],
-                ]
-
-            answer = ask_gpt_multi_message(
-                MESSAGES_BY_USER[user_id],
-                max_length=500,
-                user_defined_provider=SELECTED_PROVIDER,
-            )
-
-            MESSAGES_BY_USER[user_id].append({"role": "assistant", "content": answer})
-            if len(MESSAGES_BY_USER[user_id]) > MAX_MESSAGES_NUM:
-                MESSAGES_BY_USER[user_id] = MESSAGES_BY_USER[user_id][-MAX_MESSAGES_NUM:]
-                MESSAGES_BY_USER[user_id].insert(0, {"role": "system", "content": SYSTEM_MSG})
-
-            await update.message.reply_text(answer)
+            await process_user_turn(update, user_id, "video", (message.caption or "").strip(), video_content)
 
         except Exception as e:
-            print(f"Error handling video: {e}")
-            await update.message.reply_text("Sorry, failed to process the video.")
+            logger.error("Error handling video: %s", e)
+            await message.reply_text("Sorry, failed to process the video.")
     else:
         answer = f"Eh? Du hast doch keine Berechtigung. Deine user_id ist {user_id}."
-        print(answer)
-        await update.message.reply_text(answer)
+        logger.warning(answer)
+        await message.reply_text(answer)
 
 
 async def handle_audio_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    print("In the handle_audio_message function...")
+    logger.debug("In the handle_audio_message function...")
     user_id = update.effective_user.id
+    message = update.message
 
     if user_id in ALLOWED_USER_IDS:
         try:
-            audio = update.message.audio or update.message.voice
+            audio = message.audio or message.voice
             if not audio:
                 return
+            if not config_plugins.is_plugin_enabled("listen_audio"):
+                await message.reply_text("Audio handling is disabled.")
+                return
             
             # Determine type
-            msg_type = "audio" if update.message.audio else "voice"
+            msg_type = "audio" if message.audio else "voice"
             
-            print(f"DEBUG({msg_type}): file_id={audio.file_id}, mime={audio.mime_type}, size={audio.file_size}")
+            logger.debug("DEBUG(%s): file_id=%s, mime=%s, size=%s", msg_type, audio.file_id, audio.mime_type, audio.file_size)
             
             audio_content = {
                 "type": msg_type, 
@@ -685,82 +846,32 @@ async def handle_audio_message(update: Update, context: ContextTypes.DEFAULT_TYP
                 "file_name": getattr(audio, "file_name", "audio.mp3")
             }
             
-            content_parts = []
-            if isinstance(update.message.caption, str) and len(update.message.caption.strip()) > 0:
-                content_parts.append({"type": "text", "text": update.message.caption.strip()})
-            content_parts.append(audio_content)
-            
-            user_input = update.message.caption or ""
-            
-            # Provider update logic
-            switch7, report = update_provider_from_user_input(user_input)
-            if switch7:
-                await update.message.reply_text(report)
-            
-            # Strip indicator
-            for provider, indicators in PROVIDER_INDICATORS.items():
-                for indicator in indicators:
-                    if user_input.lower().startswith(indicator):
-                        user_input = user_input[len(indicator) :].strip()
-
-            # Temp messages for plugins
-            temp_messages = []
-            if user_id in MESSAGES_BY_USER:
-                temp_messages = MESSAGES_BY_USER[user_id].copy()
-            
-            temp_messages.append({"role": "user", "content": content_parts})
-            
-            plugin_processed = False
-            current_provider = SELECTED_PROVIDER if SELECTED_PROVIDER else PROVIDER_FROM_ENV
-            final_messages = temp_messages # Default
-            
-            for plugin in PLUGINS:
-                try:
-                    if plugin.is_plugin_applicable(temp_messages, current_provider):
-                        print(f"Plugin {plugin.__name__} triggered.")
-                        updated_messages = plugin.process_messages(temp_messages, current_provider)
-                        if updated_messages:
-                            final_messages = updated_messages
-                            plugin_processed = True
-                            await update.message.reply_text(f"Processed by plugin: {plugin.__name__.split('.')[-1]}")
-                            break 
-                except Exception as e:
-                    print(f"Error executing plugin {plugin.__name__}: {e}")
-            
-            if user_id in MESSAGES_BY_USER:
-                MESSAGES_BY_USER[user_id].append(final_messages[-1])
-            else:
-                MESSAGES_BY_USER[user_id] = [
-                    {"role": "system", "content": SYSTEM_MSG},
-                    final_messages[-1],
-                ]
-
-            answer = ask_gpt_multi_message(
-                MESSAGES_BY_USER[user_id],
-                max_length=500,
-                user_defined_provider=SELECTED_PROVIDER,
-            )
-
-            MESSAGES_BY_USER[user_id].append({"role": "assistant", "content": answer})
-            if len(MESSAGES_BY_USER[user_id]) > MAX_MESSAGES_NUM:
-                MESSAGES_BY_USER[user_id] = MESSAGES_BY_USER[user_id][-MAX_MESSAGES_NUM:]
-                MESSAGES_BY_USER[user_id].insert(0, {"role": "system", "content": SYSTEM_MSG})
-
-            await update.message.reply_text(answer)
+            await process_user_turn(update, user_id, "audio", (message.caption or "").strip(), audio_content)
 
         except Exception as e:
-            print(f"Error handling audio: {e}")
-            await update.message.reply_text("Sorry, failed to process the audio.")
+            logger.error("Error handling audio: %s", e)
+            await message.reply_text("Sorry, failed to process the audio.")
     else:
         answer = f"Eh? Du hast doch keine Berechtigung. Deine user_id ist {user_id}."
-        print(answer)
-        await update.message.reply_text(answer)
+        logger.warning(answer)
+        await message.reply_text(answer)
+
+
+async def post_init(app: Application) -> None:
+    # asyncio.to_thread runs on the default executor; size it for image work
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=IMG_POOL_SIZE, thread_name_prefix="img")
+    )
+
+
+async def shutdown(app: Application) -> None:
+    await aclose_http_client()
 
 
 async def restrict(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     text = f"Keine Berechtigung für user_id {user_id}."
-    print(text)
+    logger.warning(text)
     await context.bot.send_message(
         chat_id=update.effective_chat.id,
         text=f"Keine Berechtigung für user_id {user_id}.",
@@ -768,13 +879,29 @@ async def restrict(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 def main():
-    print("In the main function...")
-    app = Application.builder().token(TOKEN).build()
+    logger.info("In the main function...")
+    # Handlers run as background tasks by default, so a slow LLM call never holds up other updates
+    app = (
+        Application.builder()
+        .token(TOKEN)
+        .defaults(Defaults(block=False))
+        .concurrent_updates(True)
+        .post_init(post_init)
+        .post_shutdown(shutdown)
+        .request(HTTPXRequest(connection_pool_size=TELEGRAM_POOL_SIZE, http_version="2", connect_timeout=15))
+        # getUpdates gets its own client, so a pending long poll never holds a
+        # connection that replies need; its read must outlast the long poll
+        .get_updates_request(HTTPXRequest(connection_pool_size=1, http_version="2", read_timeout=POLL_TIMEOUT_S + 5))
+        # Paces every outgoing call to Telegram's flood limits (30/s overall,
+        # 20/min per group) instead of running into 429 storms during bursts
+        .rate_limiter(AIORateLimiter(max_retries=TELEGRAM_MAX_RETRIES))
+        .build()
+    )
 
     """Restrict fhs bot to the specified user_id.
     NOTE: this should be always the first handler, to prevent the bot from responding to unauthorized users.
     """
-    restrict_handler = MessageHandler(~filters.User(ALLOWED_USER_IDS), restrict)
+    restrict_handler = MessageHandler(~filters.User(ALLOWED_USER_IDS), restrict, block=True)
     app.add_handler(restrict_handler)
 
     app.add_handler(CommandHandler("start", start))
@@ -789,7 +916,7 @@ def main():
     app.add_handler(MessageHandler(filters.AUDIO | filters.VOICE, handle_audio_message))
     app.add_handler(MessageHandler(filters.Document.ALL, handle_image_document_message))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
-    app.run_polling()
+    app.run_polling(timeout=POLL_TIMEOUT_S, poll_interval=0.0)
 
 
 if __name__ == "__main__":
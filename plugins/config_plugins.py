@@ -5,6 +5,8 @@ This file controls which plugins are active.
 Set a plugin to False to deactivate it and save on API costs.
 """
 
+from types import MappingProxyType
+
 # Plugin activation status
 PLUGIN_STATUS = {
     "summarize_youtube_video": True,
@@ -16,6 +18,9 @@ PLUGIN_STATUS = {
     "reaction_tracker": True,  # Tracks message reactions for learning from user feedback
 }
 
+# Read-only live view of PLUGIN_STATUS, handed out instead of a fresh copy per call
+_STATUS_VIEW = MappingProxyType(PLUGIN_STATUS)
+
 def is_plugin_enabled(plugin_name):
     """
     Check if a plugin is enabled.
@@ -53,5 +58,5 @@ def disable_all_plugins():
         PLUGIN_STATUS[plugin_name] = False
 
 def get_plugin_status():
-    """Get the current status of all plugins."""
-    return PLUGIN_STATUS.copy()
+    """Get the current status of all plugins, as a read-only view that reflects later changes."""
+    return _STATUS_VIEW
@@ -14,8 +14,13 @@ Unsupported Providers:
 - Others: Typically no generation support
 """
 
+import logging
 import re
 
+from utils.messages import last_user_parts
+
+logger = logging.getLogger(__name__)
+
 # List of providers that support image generation
 SUPPORTED_PROVIDERS = ["gemini", "openai"]
 
@@ -25,8 +30,15 @@ KEYWORDS = [
     "generar imagen", "crear imagen", "dibuja", "pinta", "foto de",
     "generate a picture", "create a picture", "haz un dibujo", "haz una imagen"
 ]
+# All keywords in one pattern, so a message is scanned once however many keywords there are
+_KEYWORDS_RE = re.compile("|".join(re.escape(keyword) for keyword in KEYWORDS))
+
+# Message types this plugin inspects; captions of media messages are checked too
+SUPPORTED_CONTENT_TYPES = {"text", "image", "video", "audio"}
+# is_plugin_applicable only inspects the last message, so it runs inline
+FAST_APPLICABILITY = True
 
-def is_plugin_applicable(messages, provider):
+def is_plugin_applicable(messages, provider, *, text_lower=None):
     """
     Determines if this plugin should process the current message.
     
@@ -37,36 +49,19 @@ def is_plugin_applicable(messages, provider):
     Args:
         messages: List of message dicts with 'role' and 'content'
         provider: Active AI provider (e.g., 'openai', 'anthropic')
+        text_lower: The last message's text, already lowercased by the bot
     
     Returns:
         bool: True if message contains image generation keywords
     """
-    if not messages:
-        return False
-    
-    last_message = messages[-1]
-    if last_message.get("role") != "user":
-        return False
-    
-    content = last_message.get("content", "")
-    
-    # Extract text content (handle both string and multimodal list formats)
-    text_content = ""
-    if isinstance(content, list):
-        for part in content:
-            if part.get("type") == "text":
-                text_content += part.get("text", "") + " "
-    elif isinstance(content, str):
-        text_content = content
-    
-    # Case-insensitive keyword matching
-    text_content = text_content.lower()
-    
-    for keyword in KEYWORDS:
-        if keyword in text_content:
-            return True
-            
-    return False
+    if text_lower is None:
+        text, _, _ = last_user_parts(messages)
+        if text is None:
+            return False
+        # Case-insensitive keyword matching
+        text_lower = text.lower()
+
+    return _KEYWORDS_RE.search(text_lower) is not None
 
 def process_messages(messages, provider):
     """
@@ -96,11 +91,11 @@ def process_messages(messages, provider):
                 break
     
     if is_supported:
-        print(f"Plugin generate_picture: Provider {provider} supports image generation. Proceeding.")
+        logger.debug("Provider %s supports image generation. Proceeding.", provider)
         # Request passes through unchanged - provider will handle generation
         return messages
     else:
-        print(f"Plugin generate_picture: Provider {provider} does NOT support image generation. Blocking.")
+        logger.info("Provider %s does NOT support image generation. Blocking.", provider)
         # Replace request with helpful error message
         messages[-1]["content"] = f"Sorry, the current AI provider ({provider}) does not support image generation. Please switch to Gemini or OpenAI."
         return messages
@@ -14,8 +14,25 @@ Unsupported Providers:
 - Others: Typically text/vision only
 """
 
+import logging
+import re
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
 # List of providers that support native audio input
 SUPPORTED_PROVIDERS = ["gemini", "openai"]
+# Bare provider names, checked before the substring search
+_EXACT_PROVIDERS = frozenset(SUPPORTED_PROVIDERS)
+# Matches any supported provider name inside a (lowercased) provider string
+_SUPPORTED_RE = re.compile("|".join(map(re.escape, SUPPORTED_PROVIDERS)))
+# Content part types that carry audio
+_AUDIO_TYPES = frozenset(("audio", "voice"))
+
+# Message types this plugin inspects (see plugins/README.md)
+SUPPORTED_CONTENT_TYPES = {"audio"}
+# is_plugin_applicable only inspects the last message, so it runs inline
+FAST_APPLICABILITY = True
 
 def is_plugin_applicable(messages, provider):
     """
@@ -42,17 +59,16 @@ def is_plugin_applicable(messages, provider):
     content = last_message.get("content", "")
     
     # Check if content contains audio or voice (content can be a list of parts for multimodal)
-    has_audio = False
-    if isinstance(content, list):
-        for part in content:
-            if part.get("type") == "audio" or part.get("type") == "voice":
-                has_audio = True
-                break
-    
-    if has_audio:
-        return True
-            
-    return False
+    return isinstance(content, list) and any(part.get("type") in _AUDIO_TYPES for part in content)
+
+@lru_cache(maxsize=64)
+def _provider_supports_audio(provider):
+    # Provider names are a small closed set, so this is decided once per name;
+    # only vendor-prefixed names such as "openai-gpt4o" need the substring search
+    if not provider:
+        return False
+    provider = provider.lower()
+    return provider in _EXACT_PROVIDERS or _SUPPORTED_RE.search(provider) is not None
 
 def process_messages(messages, provider):
     """
@@ -73,20 +89,14 @@ def process_messages(messages, provider):
         return messages
         
     # Check if provider is supported (partial string matching)
-    is_supported = False
-    if provider:
-        provider_lower = provider.lower()
-        for supported in SUPPORTED_PROVIDERS:
-            if supported in provider_lower:
-                is_supported = True
-                break
+    is_supported = _provider_supports_audio(provider or "")
     
     if is_supported:
-        print(f"Plugin listen_audio: Provider {provider} supports audio. Proceeding.")
+        logger.debug("Provider %s supports audio. Proceeding.", provider)
         # Audio content passes through unchanged - the provider wrapper will handle it
         return messages
     else:
-        print(f"Plugin listen_audio: Provider {provider} does NOT support audio. Blocking.")
+        logger.info("Provider %s does NOT support audio. Blocking.", provider)
         # Replace audio content with helpful error message
         messages[-1]["content"] = f"Sorry, the current AI provider ({provider}) does not support audio analysis."
         return messages
@@ -4,11 +4,15 @@ Analytics utilities for Telegram Reaction Tracker
 Provides analytics and reporting features for reaction data.
 """
 
+import io
 import logging
-from typing import Dict, List, Optional, Tuple
-from datetime import datetime, timedelta
+import sqlite3
+import time
+from typing import Dict, List, Optional, TextIO, Tuple
+from datetime import datetime
 from collections import Counter
-import json
+
+import orjson
 
 from .database import ReactionDatabase
 
@@ -16,6 +20,89 @@ from .database import ReactionDatabase
 logger = logging.getLogger(__name__)
 
 
+def _query_variants(head: str, tail: str) -> Dict[Tuple[bool, bool], str]:
+    """
+    Build the fixed set of SQL strings for an optionally filtered query.
+    
+    Keys are (by_chat, by_time). Identical strings on every call let
+    sqlite3's statement cache reuse the compiled statement instead of
+    re-parsing a freshly concatenated query each time.
+    """
+    variants = {}
+    for by_chat in (False, True):
+        for by_time in (False, True):
+            query = head
+            if by_chat:
+                query += " AND chat_id = ?"
+            if by_time:
+                query += " AND timestamp >= ?"
+            variants[by_chat, by_time] = query + tail
+    return variants
+
+
+def _filter_params(chat_id: Optional[int], cutoff: Optional[int]) -> List:
+    """Parameters matching the filters appended by _query_variants."""
+    params = []
+    if chat_id is not None:
+        params.append(chat_id)
+    if cutoff is not None:
+        params.append(cutoff)
+    return params
+
+
+def _cutoff(days_back: Optional[int]) -> Optional[int]:
+    """Unix timestamp `days_back` days ago, or None for no time filter."""
+    if days_back is None:
+        return None
+    return int(time.time()) - days_back * 86400
+
+
+_POPULAR_EMOJI_TAIL = " GROUP BY reaction_emoji ORDER BY count DESC"
+
+_POPULAR_EMOJI_QUERIES = _query_variants(
+    """
+                SELECT reaction_emoji, COUNT(*) as count
+                FROM message_reactions
+                WHERE action = 'added'
+            """,
+    _POPULAR_EMOJI_TAIL,
+)
+
+_ACTIVE_USERS_QUERIES = _query_variants(
+    """
+                SELECT user_id, COUNT(*) as count
+                FROM message_reactions
+                WHERE user_id IS NOT NULL AND action = 'added'
+            """,
+    " GROUP BY user_id ORDER BY count DESC LIMIT ?",
+)
+
+# Totals, unique users and unique messages in one pass over the slice;
+# COUNT(DISTINCT user_id) already skips anonymous (NULL) reactions
+_ENGAGEMENT_QUERIES = _query_variants(
+    """
+                SELECT COUNT(*), COUNT(DISTINCT user_id), COUNT(DISTINCT message_id)
+                FROM message_reactions
+                WHERE action = 'added'
+            """,
+    "",
+)
+
+_EXPORT_QUERIES = _query_variants(
+    "SELECT * FROM message_reactions WHERE 1=1",
+    " ORDER BY timestamp DESC",
+)
+
+_TRENDING_QUERIES = _query_variants(
+    """
+                SELECT chat_id, message_id, COUNT(*) as reaction_count
+                FROM message_reactions
+                WHERE action = 'added'
+            """,
+    " GROUP BY chat_id, message_id ORDER BY reaction_count DESC LIMIT ?",
+)
+
+
 class ReactionAnalytics:
     """
     Analytics engine for reaction data.
@@ -35,7 +122,8 @@ class ReactionAnalytics:
     def get_most_popular_emoji(
         self,
         chat_id: Optional[int] = None,
-        days_back: Optional[int] = None
+        days_back: Optional[int] = None,
+        whitelist: Optional[List[str]] = None
     ) -> List[Tuple[str, int]]:
         """
         Get most popular reaction emojis.
@@ -43,33 +131,28 @@ class ReactionAnalytics:
         Args:
             chat_id: Filter by chat ID (None = all chats)
             days_back: Only include reactions from last N days
+            whitelist: Only count these emojis, e.g. Config.allowed_reactions
+                (None = all emojis)
         
         Returns:
             List of (emoji, count) tuples ordered by popularity
         """
-        with self.db._get_connection() as conn:
-            cursor = conn.cursor()
-            
-            query = """
-                SELECT reaction_emoji, COUNT(*) as count
-                FROM message_reactions
-                WHERE action = 'added'
-            """
-            params = []
-            
-            if chat_id is not None:
-                query += " AND chat_id = ?"
-                params.append(chat_id)
-            
-            if days_back is not None:
-                cutoff = int((datetime.now() - timedelta(days=days_back)).timestamp())
-                query += " AND timestamp >= ?"
-                params.append(cutoff)
-            
-            query += " GROUP BY reaction_emoji ORDER BY count DESC"
-            
-            cursor.execute(query, params)
-            return [(row[0], row[1]) for row in cursor.fetchall()]
+        with self.db._get_ro_connection() as conn:
+            query = _POPULAR_EMOJI_QUERIES[chat_id is not None, days_back is not None]
+            params = _filter_params(chat_id, _cutoff(days_back))
+            
+            if whitelist is not None:
+                # Filter in SQL so rows outside the whitelist are never returned
+                placeholders = ",".join("?" * len(whitelist))
+                query = (
+                    query.removesuffix(_POPULAR_EMOJI_TAIL)
+                    + f" AND reaction_emoji IN ({placeholders})"
+                    + _POPULAR_EMOJI_TAIL
+                )
+                params.extend(whitelist)
+            
+            cursor = conn.execute(query, params)
+            return [(row[0], row[1]) for row in cursor]
     
     def get_most_active_users(
         self,
@@ -88,36 +171,19 @@ class ReactionAnalytics:
         Returns:
             List of (user_id, reaction_count) tuples
         """
-        with self.db._get_connection() as conn:
-            cursor = conn.cursor()
-            
-            query = """
-                SELECT user_id, COUNT(*) as count
-                FROM message_reactions
-                WHERE user_id IS NOT NULL AND action = 'added'
-            """
-            params = []
-            
-            if chat_id is not None:
-                query += " AND chat_id = ?"
-                params.append(chat_id)
-            
-            if days_back is not None:
-                cutoff = int((datetime.now() - timedelta(days=days_back)).timestamp())
-                query += " AND timestamp >= ?"
-                params.append(cutoff)
-            
-            query += " GROUP BY user_id ORDER BY count DESC LIMIT ?"
+        with self.db._get_ro_connection() as conn:
+            query = _ACTIVE_USERS_QUERIES[chat_id is not None, days_back is not None]
+            params = _filter_params(chat_id, _cutoff(days_back))
             params.append(limit)
             
-            cursor.execute(query, params)
-            return [(row[0], row[1]) for row in cursor.fetchall()]
+            cursor = conn.execute(query, params)
+            return [(row[0], row[1]) for row in cursor]
     
     def get_reaction_timeline(
         self,
         chat_id: int,
         message_id: int
-    ) -> List[Dict]:
+    ) -> List[sqlite3.Row]:
         """
         Get timeline of reactions for a specific message.
         
@@ -126,33 +192,28 @@ class ReactionAnalytics:
             message_id: Message ID
         
         Returns:
-            List of reaction events ordered by time
+            List of reaction events (sqlite3.Row) ordered by time
         """
-        reactions = self.db.get_message_reactions(chat_id, message_id)
-        
-        # Sort by timestamp
-        reactions.sort(key=lambda x: x['timestamp'])
-        
-        return reactions
+        return self.db.get_message_reactions(chat_id, message_id, order='ASC')
     
     def get_user_favorite_emoji(self, user_id: int) -> Optional[str]:
         """
         Get user's most frequently used reaction emoji.
         
+        Served from the per-user user_emoji_counts summary, which is kept
+        up to date on write, instead of re-aggregating the user's history.
+        
         Args:
             user_id: User ID
         
         Returns:
             Most used emoji or None
         """
-        with self.db._get_connection() as conn:
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                SELECT reaction_emoji, COUNT(*) as count
-                FROM message_reactions
-                WHERE user_id = ? AND action = 'added'
-                GROUP BY reaction_emoji
+        with self.db._get_ro_connection() as conn:
+            cursor = conn.execute("""
+                SELECT reaction_emoji
+                FROM user_emoji_counts
+                WHERE user_id = ?
                 ORDER BY count DESC
                 LIMIT 1
             """, (user_id,))
@@ -175,43 +236,12 @@ class ReactionAnalytics:
         Returns:
             Dictionary with engagement metrics
         """
-        cutoff = int((datetime.now() - timedelta(days=days_back)).timestamp())
-        
-        with self.db._get_connection() as conn:
-            cursor = conn.cursor()
-            
-            # Total reactions
-            query = "SELECT COUNT(*) FROM message_reactions WHERE action = 'added' AND timestamp >= ?"
-            params = [cutoff]
-            
-            if chat_id is not None:
-                query += " AND chat_id = ?"
-                params.append(chat_id)
-            
-            cursor.execute(query, params)
-            total_reactions = cursor.fetchone()[0]
+        with self.db._get_ro_connection() as conn:
+            query = _ENGAGEMENT_QUERIES[chat_id is not None, True]
+            params = _filter_params(chat_id, _cutoff(days_back))
             
-            # Unique users
-            query = "SELECT COUNT(DISTINCT user_id) FROM message_reactions WHERE action = 'added' AND timestamp >= ? AND user_id IS NOT NULL"
-            params = [cutoff]
-            
-            if chat_id is not None:
-                query += " AND chat_id = ?"
-                params.append(chat_id)
-            
-            cursor.execute(query, params)
-            unique_users = cursor.fetchone()[0]
-            
-            # Unique messages
-            query = "SELECT COUNT(DISTINCT message_id) FROM message_reactions WHERE action = 'added' AND timestamp >= ?"
-            params = [cutoff]
-            
-            if chat_id is not None:
-                query += " AND chat_id = ?"
-                params.append(chat_id)
-            
-            cursor.execute(query, params)
-            unique_messages = cursor.fetchone()[0]
+            cursor = conn.execute(query, params)
+            total_reactions, unique_users, unique_messages = cursor.fetchone()
             
             return {
                 'total_reactions': total_reactions,
@@ -225,44 +255,48 @@ class ReactionAnalytics:
     def export_to_json(
         self,
         chat_id: Optional[int] = None,
-        days_back: Optional[int] = None
-    ) -> str:
+        days_back: Optional[int] = None,
+        fp: Optional[TextIO] = None
+    ) -> Optional[str]:
         """
         Export reaction data to JSON format.
         
+        Rows are streamed from the cursor and written one at a time, so a
+        large export never holds the whole result set in memory. The output
+        is compact; `total_records` follows the `reactions` array because it
+        is only known once the rows have been written.
+        
         Args:
             chat_id: Filter by chat ID (None = all chats)
             days_back: Only include reactions from last N days
+            fp: Text file to write to (None = return the JSON as a string)
         
         Returns:
-            JSON string with reaction data
+            JSON string with reaction data, or None when written to `fp`
         """
-        with self.db._get_connection() as conn:
-            cursor = conn.cursor()
-            
-            query = "SELECT * FROM message_reactions WHERE 1=1"
-            params = []
-            
-            if chat_id is not None:
-                query += " AND chat_id = ?"
-                params.append(chat_id)
-            
-            if days_back is not None:
-                cutoff = int((datetime.now() - timedelta(days=days_back)).timestamp())
-                query += " AND timestamp >= ?"
-                params.append(cutoff)
+        if fp is None:
+            buffer = io.StringIO()
+            self.export_to_json(chat_id, days_back, fp=buffer)
+            return buffer.getvalue()
+        
+        with self.db._get_ro_connection() as conn:
+            query = _EXPORT_QUERIES[chat_id is not None, days_back is not None]
+            params = _filter_params(chat_id, _cutoff(days_back))
             
-            query += " ORDER BY timestamp DESC"
+            cursor = conn.execute(query, params)
             
-            cursor.execute(query, params)
+            export_date = orjson.dumps(datetime.now().isoformat()).decode()
+            fp.write(f'{{"export_date":{export_date},"reactions":[')
             
-            reactions = [dict(row) for row in cursor.fetchall()]
+            total_records = 0
+            for row in cursor:
+                if total_records:
+                    fp.write(",")
+                fp.write(orjson.dumps(dict(row)).decode())
+                total_records += 1
             
-            return json.dumps({
-                'export_date': datetime.now().isoformat(),
-                'total_records': len(reactions),
-                'reactions': reactions
-            }, indent=2)
+            fp.write(f'],"total_records":{total_records}}}')
+            return None
     
     def get_trending_messages(
         self,
@@ -281,29 +315,17 @@ class ReactionAnalytics:
         Returns:
             List of trending message stats
         """
-        cutoff = int((datetime.now() - timedelta(hours=hours_back)).timestamp())
+        cutoff = int(time.time()) - hours_back * 3600
         
-        with self.db._get_connection() as conn:
-            cursor = conn.cursor()
-            
-            query = """
-                SELECT chat_id, message_id, COUNT(*) as reaction_count
-                FROM message_reactions
-                WHERE action = 'added' AND timestamp >= ?
-            """
-            params = [cutoff]
-            
-            if chat_id is not None:
-                query += " AND chat_id = ?"
-                params.append(chat_id)
-            
-            query += " GROUP BY chat_id, message_id ORDER BY reaction_count DESC LIMIT ?"
+        with self.db._get_ro_connection() as conn:
+            query = _TRENDING_QUERIES[chat_id is not None, True]
+            params = _filter_params(chat_id, cutoff)
             params.append(limit)
             
-            cursor.execute(query, params)
+            cursor = conn.execute(query, params)
             
             trending = []
-            for row in cursor.fetchall():
+            for row in cursor:
                 trending.append({
                     'chat_id': row[0],
                     'message_id': row[1],
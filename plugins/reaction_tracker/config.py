@@ -6,9 +6,28 @@ Manages plugin settings and configuration options.
 
 from dataclasses import dataclass
 from typing import Optional, List
+import logging
 import os
 
 
+logger = logging.getLogger(__name__)
+
+
+# (field, environment variable, type, default) for Config.from_env
+_ENV_SPEC = (
+    ("database_path", "REACTION_DB_PATH", str, "reactions.db"),
+    ("track_anonymous", "REACTION_TRACK_ANONYMOUS", bool, True),
+    ("store_message_text", "REACTION_STORE_TEXT", bool, True),
+    ("max_history_days", "REACTION_MAX_HISTORY_DAYS", int, 0),
+    ("verbose_logging", "REACTION_VERBOSE", bool, False),
+)
+
+_BOOL_VALUES = {
+    "true": True, "1": True, "yes": True, "on": True,
+    "false": False, "0": False, "no": False, "off": False,
+}
+
+
 @dataclass
 class Config:
     """
@@ -44,16 +63,26 @@ class Config:
             REACTION_MAX_HISTORY_DAYS: Max history days
             REACTION_VERBOSE: Verbose logging (true/false)
         
+        Switches also accept 1/0, yes/no and on/off. Any other value turns
+        the switch off, with a warning, so a typo never enables tracking.
+        
         Returns:
             Config instance
         """
-        return cls(
-            database_path=os.getenv("REACTION_DB_PATH", "reactions.db"),
-            track_anonymous=os.getenv("REACTION_TRACK_ANONYMOUS", "true").lower() == "true",
-            store_message_text=os.getenv("REACTION_STORE_TEXT", "true").lower() == "true",
-            max_history_days=int(os.getenv("REACTION_MAX_HISTORY_DAYS", "0")),
-            verbose_logging=os.getenv("REACTION_VERBOSE", "false").lower() == "true"
-        )
+        values = {}
+        for field, env_var, kind, default in _ENV_SPEC:
+            raw = os.environ.get(env_var)
+            if raw is None:
+                values[field] = default
+            elif kind is bool:
+                value = _BOOL_VALUES.get(raw.strip().lower())
+                if value is None:
+                    logger.warning("Unrecognised value %r for %s; treating it as false", raw, env_var)
+                    value = False
+                values[field] = value
+            else:
+                values[field] = kind(raw)
+        return cls(**values)
     
     def validate(self) -> None:
         """
@@ -5,22 +5,106 @@ Handles all database operations for storing and querying reaction data.
 """
 
 import sqlite3
-import json
 import logging
+import queue
+import time
 from typing import List, Dict, Optional, Tuple
-from datetime import datetime, timedelta
+from collections import OrderedDict
 from contextlib import contextmanager
+from pathlib import Path
 import threading
+import weakref
+
+import orjson
 
 
 logger = logging.getLogger(__name__)
 
+# Upper bound on cached get_message_stats results
+STATS_CACHE_SIZE = 4096
+
+# Idle connections kept for reuse
+READ_POOL_SIZE = 8
+WRITE_POOL_SIZE = 2
+
+# Bloom filter over messages that have stored reactions: 2**23 bits (1 MiB)
+# with 7 probes stays near a 1 % false-positive rate up to ~800k messages
+MESSAGE_BLOOM_BITS = 1 << 23
+MESSAGE_BLOOM_PROBES = 7
+
+
+def _close_pools(*pools: "queue.LifoQueue[sqlite3.Connection]") -> None:
+    """Close every idle connection in the given pools."""
+    for pool in pools:
+        while True:
+            try:
+                pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+# Shared by store_reaction and store_reactions_bulk so both hit the same
+# compiled statement in sqlite3's per-connection statement cache
+_INSERT_REACTION_SQL = """
+    INSERT INTO message_reactions
+    (chat_id, message_id, user_id, actor_chat_id, reaction_emoji, action, timestamp, message_text)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+# Keeps user_emoji_counts in step with 'added' reaction events
+_COUNT_USER_EMOJI_SQL = """
+    INSERT INTO user_emoji_counts (user_id, reaction_emoji, count)
+    VALUES (?, ?, 1)
+    ON CONFLICT(user_id, reaction_emoji) DO UPDATE SET count = count + 1
+"""
+
+_REBUILD_USER_EMOJI_SQL = """
+    INSERT INTO user_emoji_counts (user_id, reaction_emoji, count)
+    SELECT user_id, reaction_emoji, COUNT(*)
+    FROM message_reactions
+    WHERE action = 'added' AND user_id IS NOT NULL
+    GROUP BY user_id, reaction_emoji
+"""
+
+
+class _MessageBloom:
+    """
+    Fixed-size Bloom filter of (chat_id, message_id) pairs.
+    
+    Answers "might this message have reactions?" without touching the
+    database; a miss is definitive, a hit may be a false positive.
+    """
+    
+    def __init__(self, bits: int = MESSAGE_BLOOM_BITS, probes: int = MESSAGE_BLOOM_PROBES):
+        self._mask = bits - 1
+        self._probes = probes
+        self._bits = bytearray(bits // 8)
+        self._lock = threading.Lock()
+    
+    def _positions(self, chat_id: int, message_id: int):
+        # Double hashing; int tuple hashes are not randomized per process
+        h1 = hash((chat_id, message_id))
+        h2 = hash((message_id, chat_id, 0x9E3779B9)) | 1
+        return [(h1 + i * h2) & self._mask for i in range(self._probes)]
+    
+    def add(self, chat_id: int, message_id: int) -> None:
+        positions = self._positions(chat_id, message_id)
+        with self._lock:
+            for pos in positions:
+                self._bits[pos >> 3] |= 1 << (pos & 7)
+    
+    def __contains__(self, key: Tuple[int, int]) -> bool:
+        bits = self._bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(*key))
+
 
 class ReactionDatabase:
     """
     Database abstraction layer for reaction tracking.
     
-    Manages SQLite database operations with thread-safe access.
+    Manages SQLite database operations with thread-safe access. Connections
+    are checked out of small pools per operation rather than pinned to
+    threads, so worker threads that exit don't leave handles open.
     """
     
     def __init__(self, database_path: str):
@@ -31,40 +115,129 @@ class ReactionDatabase:
             database_path: Path to SQLite database file
         """
         self.database_path = database_path
-        self._local = threading.local()
+        # Every connection to ":memory:" is its own empty database, so an
+        # in-memory database lives on a single shared connection
+        self._in_memory = database_path == ":memory:"
+        self._stats_cache: "OrderedDict[Tuple[int, int], Dict]" = OrderedDict()
+        self._stats_lock = threading.Lock()
+        self._reacted_messages = _MessageBloom()
+        self._ro_pool: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue(maxsize=READ_POOL_SIZE)
+        self._rw_pool: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue(
+            maxsize=1 if self._in_memory else WRITE_POOL_SIZE
+        )
+        if self._in_memory:
+            self._rw_pool.put_nowait(self._connect())
+        # Closes idle connections if the instance is dropped without close()
+        self._finalizer = weakref.finalize(self, _close_pools, self._rw_pool, self._ro_pool)
         self._init_database()
     
+    def _connect(self, read_only: bool = False) -> sqlite3.Connection:
+        """
+        Open a connection tuned for a mixed read/write workload.
+        
+        WAL lets analytics reads run alongside reaction writes, NORMAL sync
+        is durable under WAL, and the larger page cache plus memory-mapped
+        reads turn most lookups into page-cache hits instead of read() calls.
+        The statement cache is sized to hold every query variant the
+        analytics helpers use, so none of them is compiled twice.
+        
+        Args:
+            read_only: Open the file with mode=ro (WAL is already set up by
+                the read-write connection created in __init__)
+        
+        Returns:
+            sqlite3.Connection: Database connection
+        """
+        if read_only:
+            uri = f"{Path(self.database_path).resolve().as_uri()}?mode=ro"
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False, cached_statements=256)
+        else:
+            conn = sqlite3.connect(self.database_path, check_same_thread=False, cached_statements=256)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            # Checkpoint less often during bursts; checkpoint() runs the full one
+            conn.execute("PRAGMA wal_autocheckpoint=4000")
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA cache_size=-65536")  # 64 MiB
+        conn.execute("PRAGMA mmap_size=268435456")  # 256 MiB
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+    
     @contextmanager
     def _get_connection(self):
         """
-        Get thread-local database connection.
+        Borrow a read-write connection for one transaction.
+        
+        Commits when the block succeeds and rolls back when it raises. A
+        connection is opened when the pool is empty; extra ones beyond
+        WRITE_POOL_SIZE are closed on return. An in-memory database's only
+        connection is waited for instead.
         
         Yields:
             sqlite3.Connection: Database connection
         """
-        if not hasattr(self._local, 'connection'):
-            self._local.connection = sqlite3.connect(
-                self.database_path,
-                check_same_thread=False
-            )
-            self._local.connection.row_factory = sqlite3.Row
+        if self._in_memory:
+            conn = self._rw_pool.get()
+        else:
+            try:
+                conn = self._rw_pool.get_nowait()
+            except queue.Empty:
+                conn = self._connect()
         
         try:
-            yield self._local.connection
+            yield conn
         except Exception as e:
-            self._local.connection.rollback()
-            logger.error(f"Database error: {e}")
+            conn.rollback()
+            logger.error("Database error: %s", e)
             raise
         else:
-            self._local.connection.commit()
+            conn.commit()
+        finally:
+            try:
+                self._rw_pool.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+    
+    @contextmanager
+    def _get_ro_connection(self):
+        """
+        Borrow a read-only connection from the pool.
+        
+        Readers never share the writer's connection, so queries don't wait
+        on a commit in progress. A connection is opened when the pool is
+        empty; extra ones beyond READ_POOL_SIZE are closed on return.
+        An in-memory database can't be reopened read-only, so its reads
+        borrow the read-write connection.
+        
+        Yields:
+            sqlite3.Connection: Read-only database connection
+        """
+        if self._in_memory:
+            with self._get_connection() as conn:
+                yield conn
+            return
+        
+        try:
+            conn = self._ro_pool.get_nowait()
+        except queue.Empty:
+            conn = self._connect(read_only=True)
+        
+        try:
+            yield conn
+        except Exception as e:
+            logger.error("Database error: %s", e)
+            raise
+        finally:
+            try:
+                self._ro_pool.put_nowait(conn)
+            except queue.Full:
+                conn.close()
     
     def _init_database(self) -> None:
         """Initialize database schema."""
         with self._get_connection() as conn:
-            cursor = conn.cursor()
-            
             # Create message_reactions table
-            cursor.execute("""
+            conn.execute("""
                 CREATE TABLE IF NOT EXISTS message_reactions (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     chat_id INTEGER NOT NULL,
@@ -79,7 +252,7 @@ class ReactionDatabase:
             """)
             
             # Create reaction_counts table
-            cursor.execute("""
+            conn.execute("""
                 CREATE TABLE IF NOT EXISTS reaction_counts (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     chat_id INTEGER NOT NULL,
@@ -91,23 +264,77 @@ class ReactionDatabase:
                 )
             """)
             
+            # Per-user emoji totals, maintained on write for favorite-emoji lookups
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS user_emoji_counts (
+                    user_id INTEGER NOT NULL,
+                    reaction_emoji TEXT NOT NULL,
+                    count INTEGER NOT NULL,
+                    PRIMARY KEY (user_id, reaction_emoji)
+                ) WITHOUT ROWID
+            """)
+            
             # Create indexes
-            cursor.execute("""
+            conn.execute("""
                 CREATE INDEX IF NOT EXISTS idx_message_lookup 
                 ON message_reactions(chat_id, message_id)
             """)
             
-            cursor.execute("""
+            conn.execute("""
                 CREATE INDEX IF NOT EXISTS idx_user_reactions 
                 ON message_reactions(user_id, timestamp)
             """)
             
-            cursor.execute("""
+            conn.execute("""
                 CREATE INDEX IF NOT EXISTS idx_timestamp 
                 ON message_reactions(timestamp)
             """)
             
-            logger.info(f"Database initialized at {self.database_path}")
+            # Partial covering indexes for the analytics queries, which all
+            # filter on action = 'added'; the planner can answer them from the
+            # index alone instead of scanning and re-filtering the table
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_added_chat_ts
+                ON message_reactions(chat_id, timestamp, message_id, user_id, reaction_emoji)
+                WHERE action = 'added'
+            """)
+            
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_added_ts
+                ON message_reactions(timestamp, chat_id, message_id, user_id, reaction_emoji)
+                WHERE action = 'added'
+            """)
+            
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_added_user_emoji
+                ON message_reactions(user_id, reaction_emoji, timestamp, chat_id)
+                WHERE action = 'added' AND user_id IS NOT NULL
+            """)
+            
+            # Top-message queries rank reaction_counts rows, overall or per chat,
+            # so they read these in order instead of sorting the whole table
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_counts_total
+                ON reaction_counts(total_count)
+            """)
+            
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_counts_chat_total
+                ON reaction_counts(chat_id, total_count)
+            """)
+            
+            # Backfill the summary for databases created before it existed
+            if conn.execute("SELECT 1 FROM user_emoji_counts LIMIT 1").fetchone() is None:
+                conn.execute(_REBUILD_USER_EMOJI_SQL)
+            
+            # Seed the Bloom filter from the index rather than the table
+            for row in conn.execute("SELECT DISTINCT chat_id, message_id FROM message_reactions"):
+                self._reacted_messages.add(row[0], row[1])
+            
+            # Gather planner statistics for any tables that lack them
+            conn.execute("PRAGMA optimize")
+            
+            logger.info("Database initialized at %s", self.database_path)
     
     def store_reaction(
         self,
@@ -136,18 +363,46 @@ class ReactionDatabase:
         Returns:
             int: Row ID of inserted record
         """
+        # Mark the message before the insert commits so readers never miss it
+        self._reacted_messages.add(chat_id, message_id)
+        
         with self._get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                INSERT INTO message_reactions 
+            cursor = conn.execute(
+                _INSERT_REACTION_SQL,
                 (chat_id, message_id, user_id, actor_chat_id, reaction_emoji, action, timestamp, message_text)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            """, (chat_id, message_id, user_id, actor_chat_id, reaction_emoji, action, timestamp, message_text))
-            
+            )
             row_id = cursor.lastrowid
-            logger.debug(f"Stored reaction: {action} {reaction_emoji} on message {message_id}")
+            
+            if action == 'added' and user_id is not None:
+                conn.execute(_COUNT_USER_EMOJI_SQL, (user_id, reaction_emoji))
+            
+            logger.debug("Stored reaction: %s %s on message %s", action, reaction_emoji, message_id)
             return row_id
     
+    def store_reactions_bulk(self, rows: List[Tuple]) -> None:
+        """
+        Store several reaction events in one transaction.
+        
+        Args:
+            rows: Tuples of (chat_id, message_id, user_id, actor_chat_id,
+                reaction_emoji, action, timestamp, message_text)
+        """
+        if not rows:
+            return
+        
+        for row in rows:
+            self._reacted_messages.add(row[0], row[1])
+        
+        with self._get_connection() as conn:
+            conn.executemany(_INSERT_REACTION_SQL, rows)
+            
+            conn.executemany(_COUNT_USER_EMOJI_SQL, [
+                (row[2], row[4]) for row in rows
+                if row[5] == 'added' and row[2] is not None
+            ])
+            
+            logger.debug("Stored %d reactions", len(rows))
+    
     def update_reaction_count(
         self,
         chat_id: int,
@@ -166,11 +421,10 @@ class ReactionDatabase:
             reaction_breakdown: Dictionary mapping emoji to count
             timestamp: Unix timestamp
         """
-        breakdown_json = json.dumps(reaction_breakdown)
+        breakdown_json = orjson.dumps(reaction_breakdown).decode()
         
         with self._get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
+            conn.execute("""
                 INSERT INTO reaction_counts (chat_id, message_id, total_count, reaction_breakdown, last_updated)
                 VALUES (?, ?, ?, ?, ?)
                 ON CONFLICT(chat_id, message_id) DO UPDATE SET
@@ -179,33 +433,56 @@ class ReactionDatabase:
                     last_updated = excluded.last_updated
             """, (chat_id, message_id, total_count, breakdown_json, timestamp))
             
-            logger.debug(f"Updated reaction count for message {message_id}: {total_count} total")
+            logger.debug("Updated reaction count for message %s: %s total", message_id, total_count)
+        
+        # Invalidate after the commit so a concurrent read cannot re-cache the old row
+        with self._stats_lock:
+            self._stats_cache.pop((chat_id, message_id), None)
     
-    def get_message_reactions(self, chat_id: int, message_id: int) -> List[Dict]:
+    def get_message_reactions(
+        self,
+        chat_id: int,
+        message_id: int,
+        order: str = 'DESC'
+    ) -> List[sqlite3.Row]:
         """
         Get all reactions for a specific message.
         
+        Messages that never had a reaction stored are answered from an
+        in-memory Bloom filter without querying the database.
+        
         Args:
             chat_id: Chat ID
             message_id: Message ID
+            order: 'DESC' for newest first, 'ASC' for oldest first
         
         Returns:
-            List of reaction records
+            List of reaction records as sqlite3.Row (key access by column
+            name; dict(row) for a mutable copy)
         """
-        with self._get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
+        if order not in ('ASC', 'DESC'):
+            raise ValueError(f"order must be 'ASC' or 'DESC', got {order!r}")
+        
+        if (chat_id, message_id) not in self._reacted_messages:
+            return []
+        
+        with self._get_ro_connection() as conn:
+            cursor = conn.execute(f"""
                 SELECT * FROM message_reactions
                 WHERE chat_id = ? AND message_id = ?
-                ORDER BY timestamp DESC
+                ORDER BY timestamp {order}
             """, (chat_id, message_id))
             
-            return [dict(row) for row in cursor.fetchall()]
+            return cursor.fetchall()
     
     def get_message_stats(self, chat_id: int, message_id: int) -> Optional[Dict]:
         """
         Get reaction statistics for a message.
         
+        Results are kept in a bounded LRU cache that update_reaction_count
+        invalidates, so repeated lookups of the same message skip the query
+        and the breakdown parsing.
+        
         Args:
             chat_id: Chat ID
             message_id: Message ID
@@ -213,9 +490,16 @@ class ReactionDatabase:
         Returns:
             Dictionary with stats or None if not found
         """
-        with self._get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
+        key = (chat_id, message_id)
+        with self._stats_lock:
+            cached = self._stats_cache.get(key)
+            if cached is not None:
+                self._stats_cache.move_to_end(key)
+        if cached is not None:
+            return {**cached, 'reaction_breakdown': dict(cached['reaction_breakdown'])}
+        
+        with self._get_ro_connection() as conn:
+            cursor = conn.execute("""
                 SELECT * FROM reaction_counts
                 WHERE chat_id = ? AND message_id = ?
             """, (chat_id, message_id))
@@ -223,8 +507,12 @@ class ReactionDatabase:
             row = cursor.fetchone()
             if row:
                 result = dict(row)
-                result['reaction_breakdown'] = json.loads(result['reaction_breakdown'])
-                return result
+                result['reaction_breakdown'] = orjson.loads(result['reaction_breakdown'])
+                with self._stats_lock:
+                    self._stats_cache[key] = result
+                    if len(self._stats_cache) > STATS_CACHE_SIZE:
+                        self._stats_cache.popitem(last=False)
+                return {**result, 'reaction_breakdown': dict(result['reaction_breakdown'])}
             return None
     
     def get_top_reacted_messages(
@@ -244,18 +532,16 @@ class ReactionDatabase:
         Returns:
             List of message stats ordered by reaction count
         """
-        with self._get_connection() as conn:
-            cursor = conn.cursor()
-            
+        with self._get_ro_connection() as conn:
             if chat_id is not None:
-                cursor.execute("""
+                cursor = conn.execute("""
                     SELECT * FROM reaction_counts
                     WHERE chat_id = ? AND total_count >= ?
                     ORDER BY total_count DESC
                     LIMIT ?
                 """, (chat_id, min_reactions, limit))
             else:
-                cursor.execute("""
+                cursor = conn.execute("""
                     SELECT * FROM reaction_counts
                     WHERE total_count >= ?
                     ORDER BY total_count DESC
@@ -263,9 +549,9 @@ class ReactionDatabase:
                 """, (min_reactions, limit))
             
             results = []
-            for row in cursor.fetchall():
+            for row in cursor:
                 result = dict(row)
-                result['reaction_breakdown'] = json.loads(result['reaction_breakdown'])
+                result['reaction_breakdown'] = orjson.loads(result['reaction_breakdown'])
                 results.append(result)
             
             return results
@@ -275,7 +561,7 @@ class ReactionDatabase:
         user_id: int,
         limit: int = 50,
         days_back: Optional[int] = None
-    ) -> List[Dict]:
+    ) -> List[sqlite3.Row]:
         """
         Get reaction history for a specific user.
         
@@ -285,28 +571,26 @@ class ReactionDatabase:
             days_back: Only include reactions from last N days (None = all)
         
         Returns:
-            List of user's reactions
+            List of user's reactions as sqlite3.Row
         """
-        with self._get_connection() as conn:
-            cursor = conn.cursor()
-            
+        with self._get_ro_connection() as conn:
             if days_back is not None:
-                cutoff = int((datetime.now() - timedelta(days=days_back)).timestamp())
-                cursor.execute("""
+                cutoff = int(time.time()) - days_back * 86400
+                cursor = conn.execute("""
                     SELECT * FROM message_reactions
                     WHERE user_id = ? AND timestamp >= ?
                     ORDER BY timestamp DESC
                     LIMIT ?
                 """, (user_id, cutoff, limit))
             else:
-                cursor.execute("""
+                cursor = conn.execute("""
                     SELECT * FROM message_reactions
                     WHERE user_id = ?
                     ORDER BY timestamp DESC
                     LIMIT ?
                 """, (user_id, limit))
             
-            return [dict(row) for row in cursor.fetchall()]
+            return cursor.fetchall()
     
     def cleanup_old_reactions(self, days_to_keep: int) -> int:
         """
@@ -318,21 +602,33 @@ class ReactionDatabase:
         Returns:
             Number of deleted records
         """
-        cutoff = int((datetime.now() - timedelta(days=days_to_keep)).timestamp())
+        cutoff = int(time.time()) - days_to_keep * 86400
         
         with self._get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
+            cursor = conn.execute("""
                 DELETE FROM message_reactions
                 WHERE timestamp < ?
             """, (cutoff,))
-            
             deleted = cursor.rowcount
-            logger.info(f"Cleaned up {deleted} old reactions")
+            
+            if deleted:
+                conn.execute("DELETE FROM user_emoji_counts")
+                conn.execute(_REBUILD_USER_EMOJI_SQL)
+            
+            logger.info("Cleaned up %d old reactions", deleted)
             return deleted
     
+    def optimize(self) -> None:
+        """Let SQLite refresh planner statistics for tables that need it."""
+        with self._get_connection() as conn:
+            conn.execute("PRAGMA optimize")
+    
+    def checkpoint(self) -> None:
+        """Copy the WAL back into the database and truncate the WAL file."""
+        with self._get_connection() as conn:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    
     def close(self) -> None:
-        """Close database connection."""
-        if hasattr(self._local, 'connection'):
-            self._local.connection.close()
-            logger.info("Database connection closed")
+        """Close all idle database connections."""
+        self._finalizer()
+        logger.info("Database connections closed")
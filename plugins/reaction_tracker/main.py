@@ -12,8 +12,10 @@ Author: Marco
 License: Public Domain (Unlicense)
 """
 
+import asyncio
 import os
 import sys
+import time
 import logging
 from typing import Optional, Dict, List
 from datetime import datetime
@@ -29,12 +31,14 @@ except ImportError:
     TELEGRAM_AVAILABLE = False
     logging.warning("python-telegram-bot not installed. Reaction tracking will be disabled.")
 
-from database import ReactionDatabase
 from config import Config
 
 
 logger = logging.getLogger(__name__)
 
+# How often the handlers run database maintenance (optimize, WAL checkpoint)
+MAINTENANCE_INTERVAL_S = 15 * 60
+
 
 class ReactionTracker:
     """
@@ -58,8 +62,13 @@ class ReactionTracker:
             verbose_logging=False
         )
         
+        # Imported here, so loading the plugin doesn't pull in the database layer
+        # until the tracker is first created by get_tracker()
+        from database import ReactionDatabase
+
         self.db = ReactionDatabase(database_path)
-        logger.info(f"ReactionTracker initialized with database: {database_path}")
+        self._next_maintenance = time.monotonic() + MAINTENANCE_INTERVAL_S
+        logger.info("ReactionTracker initialized with database: %s", database_path)
     
     async def handle_reaction_update(
         self,
@@ -81,46 +90,39 @@ class ReactionTracker:
         user_id = reaction.user.id if reaction.user else None
         actor_chat_id = reaction.actor_chat.id if reaction.actor_chat else None
         
-        # Process old and new reactions
-        old_emojis = set()
-        new_emojis = set()
-        
-        for reaction_type in reaction.old_reaction:
-            if hasattr(reaction_type, 'emoji'):
-                old_emojis.add(reaction_type.emoji)
-        
-        for reaction_type in reaction.new_reaction:
-            if hasattr(reaction_type, 'emoji'):
-                new_emojis.add(reaction_type.emoji)
+        # Process old and new reactions (custom emoji and paid reactions have no .emoji)
+        old_emojis = frozenset(
+            emoji for reaction_type in reaction.old_reaction
+            if (emoji := getattr(reaction_type, 'emoji', None))
+        )
+        new_emojis = frozenset(
+            emoji for reaction_type in reaction.new_reaction
+            if (emoji := getattr(reaction_type, 'emoji', None))
+        )
+        if old_emojis == new_emojis:
+            return
         
         # Determine what was added and removed
         added = new_emojis - old_emojis
         removed = old_emojis - new_emojis
         
-        # Store added reactions
-        for emoji in added:
-            self.db.store_reaction(
-                chat_id=chat_id,
-                message_id=message_id,
-                reaction_emoji=emoji,
-                action='added',
-                timestamp=timestamp,
-                user_id=user_id,
-                actor_chat_id=actor_chat_id
-            )
-            logger.info(f"Reaction added: {emoji} on message {message_id}")
-        
-        # Store removed reactions
-        for emoji in removed:
-            self.db.store_reaction(
-                chat_id=chat_id,
-                message_id=message_id,
-                reaction_emoji=emoji,
-                action='removed',
-                timestamp=timestamp,
-                user_id=user_id,
-                actor_chat_id=actor_chat_id
-            )
+        # Store added and removed reactions in one transaction, off the event loop
+        rows = [
+            (chat_id, message_id, user_id, actor_chat_id, emoji, 'added', timestamp, None)
+            for emoji in added
+        ]
+        rows.extend(
+            (chat_id, message_id, user_id, actor_chat_id, emoji, 'removed', timestamp, None)
+            for emoji in removed
+        )
+        if rows:
+            await asyncio.to_thread(self.db.store_reactions_bulk, rows)
+        
+        if logger.isEnabledFor(logging.INFO):
+            for emoji in added:
+                logger.info("Reaction added: %s on message %s", emoji, message_id)
+        
+        await self._maybe_run_maintenance()
     
     async def handle_reaction_count_update(
         self,
@@ -150,14 +152,28 @@ class ReactionTracker:
                 reaction_breakdown[emoji] = count
                 total_count += count
         
-        # Update database
-        self.db.update_reaction_count(
+        # Update database off the event loop
+        await asyncio.to_thread(
+            self.db.update_reaction_count,
             chat_id=chat_id,
             message_id=message_id,
             total_count=total_count,
             reaction_breakdown=reaction_breakdown,
             timestamp=timestamp
         )
+        
+        await self._maybe_run_maintenance()
+    
+    async def _maybe_run_maintenance(self) -> None:
+        """Optimize and checkpoint the database at most once per MAINTENANCE_INTERVAL_S."""
+        now = time.monotonic()
+        if now >= self._next_maintenance:
+            self._next_maintenance = now + MAINTENANCE_INTERVAL_S
+            await asyncio.to_thread(self._run_maintenance)
+    
+    def _run_maintenance(self) -> None:
+        self.db.optimize()
+        self.db.checkpoint()
     
     def get_reaction_handler(self):
         """Get MessageReactionHandler for individual reactions."""
@@ -188,6 +204,7 @@ class ReactionTracker:
     
     def close(self):
         """Close database connection."""
+        self.db.optimize()
         self.db.close()
 
 
@@ -204,6 +221,10 @@ def get_tracker() -> ReactionTracker:
 
 
 # Plugin interface functions (required by plugin system)
+# Never applicable, so the message handlers don't consult this plugin at all
+SUPPORTED_CONTENT_TYPES = set()
+
+
 def is_plugin_applicable(messages, provider):
     """
     This plugin doesn't modify messages in the pipeline.
@@ -1,38 +1,68 @@
+import logging
 import re
-from youtube_transcript_api import YouTubeTranscriptApi
+import threading
+from cachetools import TTLCache
+from utils.messages import last_user_parts
+
+logger = logging.getLogger(__name__)
+
+# Message types this plugin inspects; captions of media messages are checked too
+SUPPORTED_CONTENT_TYPES = {"text", "image", "video", "audio"}
+# is_plugin_applicable only inspects the last message, so it runs inline
+FAST_APPLICABILITY = True
+
+_YT_ID_RE = re.compile(r'(?:v=|\/)([0-9A-Za-z_-]{11})')
+
+# Transcripts by video id; failures are remembered briefly so a video without
+# captions isn't re-requested by every user who posts it
+_TRANSCRIPT_CACHE = TTLCache(maxsize=512, ttl=3600)
+_FAILED_VIDEOS = TTLCache(maxsize=512, ttl=60)
+_CACHE_LOCK = threading.Lock()
 
 def get_youtube_video_id(url):
     """
     Extracts the video ID from a YouTube URL.
     """
-    patron = r'(?:v=|\/)([0-9A-Za-z_-]{11})'
-    resultado = re.search(patron, url)
+    resultado = _YT_ID_RE.search(url)
     return resultado.group(1) if resultado else None
 
 def extract_phrases_and_concatenate(json_data):
     """
     Extracts sentences from a JSON file and concatenates them into a single text variable.
     """
-    sentence = []
     if isinstance(json_data, list):
-        for item in json_data:
-            if 'text' in item:
-                sentence.append(item['text'])
-    else:
-        print("Unexpected JSON format")
-
-    full_text = " ".join(sentence)
-    return full_text
+        # Snippets without text are skipped rather than failing the whole transcript
+        return " ".join(item["text"] for item in json_data if "text" in item)
+    logger.warning("Unexpected JSON format")
+    return ""
 
 def get_transcript_from_url(url):
     """
     Tries to get the transcript for a YouTube URL.
     Returns the transcript text or None if failed.
+    Transcripts are cached per video for an hour.
     """
     video_id = get_youtube_video_id(url)
     if not video_id:
         return None
     
+    with _CACHE_LOCK:
+        if video_id in _TRANSCRIPT_CACHE:
+            return _TRANSCRIPT_CACHE[video_id]
+        if video_id in _FAILED_VIDEOS:
+            return None
+    transcript = _fetch_transcript(video_id)
+    with _CACHE_LOCK:
+        if transcript is None:
+            _FAILED_VIDEOS[video_id] = True
+        else:
+            _TRANSCRIPT_CACHE[video_id] = transcript
+    return transcript
+
+def _fetch_transcript(video_id):
+    # Imported on first use, so the bot starts without loading the transcript client
+    from youtube_transcript_api import YouTubeTranscriptApi
+
     try:
         # Try fetching transcript in Spanish first, then English, then auto-generated
         transcript_list = YouTubeTranscriptApi.list_transcripts(video_id)
@@ -48,7 +78,7 @@ def get_transcript_from_url(url):
         json_data = transcript.fetch()
         return extract_phrases_and_concatenate(json_data)
     except Exception as e:
-        print(f"Error fetching transcript: {e}")
+        logger.error("Error fetching transcript: %s", e)
         return None
 
 def get_summarization_prompt(transcript_text):
@@ -85,34 +115,18 @@ def get_summarization_prompt(transcript_text):
 CONTENT TO SUMMARIZE:
 {transcript_text}"""
 
-def is_plugin_applicable(messages, provider):
+def is_plugin_applicable(messages, provider, *, text_lower=None):
     """
     Returns True if the last message from the user contains a YouTube link.
     The provider argument is used to check if the model supports native video processing.
+    text_lower is the last message's text, already lowercased by the bot.
     """
-    if not messages:
-        return False
-    
-    last_message = messages[-1]
-    if last_message.get("role") != "user":
-        return False
-    
-    content = last_message.get("content", "")
-    # Handle case where content might be a list (for images)
-    if isinstance(content, list):
-        # Check text parts
-        for part in content:
-            if part.get("type") == "text":
-                text = part.get("text", "")
-                if "youtube.com" in text or "youtu.be" in text:
-                    return True
-        return False
-    
-    if isinstance(content, str):
-        if "youtube.com" in content or "youtu.be" in content:
-            return True
-            
-    return False
+    text = text_lower
+    if text is None:
+        text, _, _ = last_user_parts(messages)
+        if text is None:
+            return False
+    return "youtube.com" in text or "youtu.be" in text
 
 def process_messages(messages, provider):
     """
@@ -136,15 +150,15 @@ def process_messages(messages, provider):
                     break
     
     if url:
-        print(f"Plugin processing YouTube URL: {url}")
+        logger.info("Processing YouTube URL: %s", url)
         transcript = get_transcript_from_url(url)
         if transcript:
             prompt = get_summarization_prompt(transcript)
             # Replace the content of the last message with the prompt
             # We keep the role as 'user' so the LLM thinks the user asked for this summary
             messages[-1]["content"] = prompt
-            print("Plugin: Transcript attached to messages.")
+            logger.debug("Transcript attached to messages.")
         else:
-            print("Plugin: Failed to fetch transcript.")
+            logger.warning("Failed to fetch transcript.")
             
     return messages
@@ -14,9 +14,20 @@ Unsupported Providers:
 - Text-only models (if any)
 """
 
+import logging
+
+from utils.messages import last_user_parts
+
+logger = logging.getLogger(__name__)
+
 # List of providers that support image/vision input
 SUPPORTED_PROVIDERS = ["gemini", "openai", "anthropic"]
 
+# Message types this plugin inspects (see plugins/README.md)
+SUPPORTED_CONTENT_TYPES = {"image"}
+# is_plugin_applicable only inspects the last message, so it runs inline
+FAST_APPLICABILITY = True
+
 def is_plugin_applicable(messages, provider):
     """
     Determines if this plugin should process the current message.
@@ -32,27 +43,8 @@ def is_plugin_applicable(messages, provider):
     Returns:
         bool: True if message contains image content
     """
-    if not messages:
-        return False
-    
-    last_message = messages[-1]
-    if last_message.get("role") != "user":
-        return False
-    
-    content = last_message.get("content", "")
-    
-    # Check if content contains images (content can be a list of parts for multimodal)
-    has_image = False
-    if isinstance(content, list):
-        for part in content:
-            if part.get("type") == "image_url" or part.get("type") == "image":
-                has_image = True
-                break
-    
-    if has_image:
-        return True
-            
-    return False
+    _, has_image, _ = last_user_parts(messages)
+    return bool(has_image)
 
 def process_messages(messages, provider):
     """
@@ -81,11 +73,11 @@ def process_messages(messages, provider):
                 break
     
     if is_supported:
-        print(f"Plugin watch_picture: Provider {provider} supports images. Proceeding.")
+        logger.debug("Provider %s supports images. Proceeding.", provider)
         # Image content passes through unchanged
         return messages
     else:
-        print(f"Plugin watch_picture: Provider {provider} does NOT support images. Blocking.")
+        logger.info("Provider %s does NOT support images. Blocking.", provider)
         # Replace image content with error message
         messages[-1]["content"] = f"Sorry, the current AI provider ({provider}) does not support image analysis."
         return messages
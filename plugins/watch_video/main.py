@@ -14,9 +14,20 @@ Unsupported Providers:
 - Others: Typically text-only
 """
 
+import logging
+
+from utils.messages import last_user_parts
+
+logger = logging.getLogger(__name__)
+
 # List of providers that support native video input
 SUPPORTED_PROVIDERS = ["gemini", "openai"]
 
+# Message types this plugin inspects (see plugins/README.md)
+SUPPORTED_CONTENT_TYPES = {"video"}
+# is_plugin_applicable only inspects the last message, so it runs inline
+FAST_APPLICABILITY = True
+
 def is_plugin_applicable(messages, provider):
     """
     Determines if this plugin should process the current message.
@@ -32,27 +43,8 @@ def is_plugin_applicable(messages, provider):
     Returns:
         bool: True if message contains video content
     """
-    if not messages:
-        return False
-    
-    last_message = messages[-1]
-    if last_message.get("role") != "user":
-        return False
-    
-    content = last_message.get("content", "")
-    
-    # Check if content contains video (content can be a list of parts for multimodal)
-    has_video = False
-    if isinstance(content, list):
-        for part in content:
-            if part.get("type") == "video" or part.get("type") == "video_url":
-                has_video = True
-                break
-    
-    if has_video:
-        return True
-            
-    return False
+    _, _, has_video = last_user_parts(messages)
+    return bool(has_video)
 
 def process_messages(messages, provider):
     """
@@ -83,11 +75,11 @@ def process_messages(messages, provider):
                 break
     
     if is_supported:
-        print(f"Plugin watch_video: Provider {provider} supports video. Proceeding.")
+        logger.debug("Provider %s supports video. Proceeding.", provider)
         # Video content passes through unchanged - the provider wrapper will handle it
         return messages
     else:
-        print(f"Plugin watch_video: Provider {provider} does NOT support video. Blocking.")
+        logger.info("Provider %s does NOT support video. Blocking.", provider)
         # Replace video content with helpful error message
         messages[-1]["content"] = f"Sorry, the current AI provider ({provider}) does not support video analysis. Please switch to Gemini or GPT-4o."
         return messages
@@ -1,40 +1,136 @@
-import requests
-from bs4 import BeautifulSoup
+import importlib.util
+import logging
+import threading
 import re
+from cachetools import TTLCache
+from utils.messages import last_user_parts
+
+# lxml is only BeautifulSoup's parser, so it is looked up here but not imported
+_HTML_PARSER = "lxml" if importlib.util.find_spec("lxml") is not None else "html.parser"
+
+logger = logging.getLogger(__name__)
+
+# Page text handed to the LLM is cut at this many characters
+MAX_TEXT_CHARS = 10000
+# HTML beyond this many bytes is not downloaded or parsed
+# (leaves room for the inline scripts and styles many pages put before the content)
+MAX_HTML_BYTES = 512 * 1024
+
+# One pooled session, so repeat hosts reuse their TCP/TLS connections.
+# requests is only imported, and the session built, when the first page is fetched
+_SESSION = None
+_SESSION_LOCK = threading.Lock()
+
+# Reposted links are served from memory; failures are remembered briefly so
+# a dead link isn't refetched by every user who posts it
+_TEXT_CACHE = TTLCache(maxsize=512, ttl=3600)
+_FAILED_URLS = TTLCache(maxsize=512, ttl=60)
+_CACHE_LOCK = threading.Lock()
+
+# Message types this plugin inspects; captions of media messages are checked too
+SUPPORTED_CONTENT_TYPES = {"text", "image", "video", "audio"}
+# is_plugin_applicable only inspects the last message, so it runs inline
+FAST_APPLICABILITY = True
+
+_URL_RE = re.compile(r'https?://\S+')
+# Runs of whitespace within a line, and line breaks with any blank lines around them
+_WS_RE = re.compile(r'[^\S\n]+')
+_NL_RE = re.compile(r'\s*\n\s*')
+
+def find_url(content):
+    """
+    Returns the first URL in a message's content (a string or a list of parts), or None.
+    """
+    if isinstance(content, str):
+        texts = (content,)
+    elif isinstance(content, list):
+        texts = (part.get("text", "") for part in content if part.get("type") == "text")
+    else:
+        return None
+    for text in texts:
+        # Most messages carry no link, so skip the regex for them
+        if "http" in text:
+            url_match = _URL_RE.search(text)
+            if url_match:
+                return url_match.group(0)
+    return None
 
 def extract_text_from_url(url):
     """
     Fetches the content of a URL and extracts the visible text.
+    Results are cached per URL for an hour.
     """
+    with _CACHE_LOCK:
+        if url in _TEXT_CACHE:
+            return _TEXT_CACHE[url]
+        if url in _FAILED_URLS:
+            return None
+    text = _fetch_text_from_url(url)
+    with _CACHE_LOCK:
+        if text is None:
+            _FAILED_URLS[url] = True
+        else:
+            _TEXT_CACHE[url] = text
+    return text
+
+def _get_session():
+    global _SESSION
+    with _SESSION_LOCK:
+        if _SESSION is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            from urllib3.util.retry import Retry
+
+            session = requests.Session()
+            # Set a user agent to avoid being blocked by some sites
+            session.headers["User-Agent"] = (
+                'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+            )
+            adapter = HTTPAdapter(pool_connections=20, pool_maxsize=50, max_retries=Retry(total=2, backoff_factor=0.2))
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _SESSION = session
+        return _SESSION
+
+def _fetch_text_from_url(url):
+    from bs4 import BeautifulSoup
+
     try:
-        # Set a user agent to avoid being blocked by some sites
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        response = requests.get(url, headers=headers, timeout=10)
-        response.raise_for_status()
+        with _get_session().get(url, timeout=10, stream=True) as response:
+            response.raise_for_status()
+            content_type = response.headers.get("Content-Type", "")
+            if content_type and not content_type.startswith(("text/", "application/xhtml")):
+                logger.warning("Skipping %s: not a web page (%s)", url, content_type)
+                return None
+            # Only the start of a page fits in the prompt, so don't download or parse the rest
+            body = bytearray()
+            for block in response.iter_content(16 * 1024):
+                body += block
+                if len(body) >= MAX_HTML_BYTES:
+                    break
         
-        soup = BeautifulSoup(response.content, 'html.parser')
+        soup = BeautifulSoup(bytes(body[:MAX_HTML_BYTES]), _HTML_PARSER)
         
         # Remove script and style elements
-        for script in soup(["script", "style"]):
-            script.extract()
+        for script in soup(["script", "style", "noscript"]):
+            script.decompose()
             
-        # Get text
-        text = soup.get_text()
-        
-        # Break into lines and remove leading/trailing space on each
-        lines = (line.strip() for line in text.splitlines())
-        # Break multi-headlines into a line each
-        chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-        # Drop blank lines
-        text = '\n'.join(chunk for chunk in chunks if chunk)
+        # Collect the visible strings one line each, collapsing whitespace,
+        # and stop as soon as the limit is reached instead of walking the whole page
+        kept = []
+        size = 0
+        for string in soup.stripped_strings:
+            chunk = _NL_RE.sub('\n', _WS_RE.sub(' ', string))
+            kept.append(chunk)
+            size += len(chunk) + 1
+            if size >= MAX_TEXT_CHARS:
+                break
         
-        # Limit text length to avoid context window issues (e.g., 10000 chars)
-        return text[:10000]
+        # Limit text length to avoid context window issues
+        return '\n'.join(kept)[:MAX_TEXT_CHARS]
         
     except Exception as e:
-        print(f"Error fetching URL {url}: {e}")
+        logger.error("Error fetching URL %s: %s", url, e)
         return None
 
 def get_summarization_prompt(text):
@@ -47,33 +143,19 @@ Focus on the main points and key information.
 CONTENT:
 {text}"""
 
-def is_plugin_applicable(messages, provider):
+def is_plugin_applicable(messages, provider, *, text_lower=None):
     """
     Returns True if the last message contains a URL but is NOT a YouTube link.
+    text_lower is the last message's text, already lowercased by the bot.
     """
-    if not messages:
+    # The shared lowercased text rules out link-free messages without rescanning the parts
+    if text_lower is not None and "http" not in text_lower:
         return False
     
-    last_message = messages[-1]
-    if last_message.get("role") != "user":
+    text, _, _ = last_user_parts(messages)
+    if text is None:
         return False
-    
-    content = last_message.get("content", "")
-    
-    url = None
-    if isinstance(content, str):
-        # Simple regex for URL
-        url_match = re.search(r'https?://\S+', content)
-        if url_match:
-            url = url_match.group(0)
-    elif isinstance(content, list):
-        for part in content:
-            if part.get("type") == "text":
-                text = part.get("text", "")
-                url_match = re.search(r'https?://\S+', text)
-                if url_match:
-                    url = url_match.group(0)
-                    break
+    url = find_url(text)
     
     if url:
         # Exclude YouTube links as they are handled by another plugin
@@ -91,30 +173,16 @@ def process_messages(messages, provider):
         return messages
 
     last_message = messages[-1]
-    content = last_message.get("content", "")
-    
-    url = None
-    if isinstance(content, str):
-        url_match = re.search(r'https?://\S+', content)
-        if url_match:
-            url = url_match.group(0)
-    elif isinstance(content, list):
-        for part in content:
-            if part.get("type") == "text":
-                text = part.get("text", "")
-                url_match = re.search(r'https?://\S+', text)
-                if url_match:
-                    url = url_match.group(0)
-                    break
+    url = find_url(last_message.get("content", ""))
     
     if url:
-        print(f"Plugin web_reader processing URL: {url}")
+        logger.info("Processing URL: %s", url)
         text = extract_text_from_url(url)
         if text:
             prompt = get_summarization_prompt(text)
             messages[-1]["content"] = prompt
-            print("Plugin web_reader: Content attached to messages.")
+            logger.debug("Content attached to messages.")
         else:
-            print("Plugin web_reader: Failed to fetch content.")
+            logger.warning("Failed to fetch content.")
             
     return messages
@@ -0,0 +1,47 @@
+import unittest
+
+from utils.image_store import EXPIRED_IMAGE_TEXT, IMAGE_REF, ImageStore, expire_refs
+
+URL_A = "data:image/jpeg;base64,QUFBQQ=="
+URL_B = "data:image/jpeg;base64,QkJCQg=="
+
+
+def image_turn(url):
+    return {
+        "role": "user",
+        "content": [
+            {"type": "text", "text": "what is this?"},
+            {"type": "image_url", "image_url": {"url": url}},
+        ],
+    }
+
+
+class PersistedImageTurnTest(unittest.TestCase):
+    def test_restored_turn_does_not_resolve_to_another_users_image(self):
+        # One process stashes user A's image and persists the history
+        old_store = ImageStore(max_blobs=8)
+        persisted = expire_refs([old_store.stash(image_turn(URL_A))])
+
+        # After a restart, user B uploads first into a fresh store
+        new_store = ImageStore(max_blobs=8)
+        new_store.stash(image_turn(URL_B))
+
+        restored = new_store.materialize(persisted)
+        parts = restored[0]["content"]
+        self.assertNotIn(URL_B, repr(parts))
+        self.assertEqual(parts[1], {"type": "text", "text": EXPIRED_IMAGE_TEXT})
+
+    def test_ref_from_another_store_expires(self):
+        old_store = ImageStore(max_blobs=8)
+        stashed = old_store.stash(image_turn(URL_A))
+        self.assertEqual(stashed["content"][1]["type"], IMAGE_REF)
+
+        new_store = ImageStore(max_blobs=8)
+        new_store.stash(image_turn(URL_B))
+
+        parts = new_store.materialize([stashed])[0]["content"]
+        self.assertEqual(parts[1], {"type": "text", "text": EXPIRED_IMAGE_TEXT})
+
+
+if __name__ == "__main__":
+    unittest.main()
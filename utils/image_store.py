@@ -0,0 +1,99 @@
+from collections import OrderedDict
+from uuid import uuid4
+
+IMAGE_REF = "image_ref"
+EXPIRED_IMAGE_TEXT = "[An image was shared here earlier; it is no longer available.]"
+
+
+class ImageStore:
+    """
+    Bounded LRU store for encoded image data URLs.
+
+    Chat history keeps small {"type": "image_ref", "blob_id": ...} parts
+    instead of multi-MB base64 strings; the URLs are substituted back only
+    when a request is built. Images evicted from the store are replaced by a
+    short text note, so very old images stop being re-sent on every turn.
+    """
+
+    def __init__(self, max_blobs):
+        self.max_blobs = max_blobs
+        self._blobs = OrderedDict()
+
+    def put(self, data_url):
+        # Random ids: a ref from another process (e.g. restored history) must
+        # never resolve to an image that happens to get the same number here
+        blob_id = uuid4().hex
+        self._blobs[blob_id] = data_url
+        while len(self._blobs) > self.max_blobs:
+            self._blobs.popitem(last=False)
+        return blob_id
+
+    def get(self, blob_id):
+        data_url = self._blobs.get(blob_id)
+        if data_url is not None:
+            self._blobs.move_to_end(blob_id)
+        return data_url
+
+    def stash(self, message):
+        """Return `message` with inline data-URL images replaced by image_ref parts."""
+        content = message.get("content")
+        if not isinstance(content, list):
+            return message
+        parts = []
+        changed = False
+        for part in content:
+            url = _data_url_of(part)
+            if url is not None:
+                part = {"type": IMAGE_REF, "blob_id": self.put(url)}
+                changed = True
+            parts.append(part)
+        return {**message, "content": parts} if changed else message
+
+    def materialize(self, messages):
+        """Return a request-ready copy of `messages` with image_ref parts resolved; other messages are shared."""
+        return [self._materialize_message(message) for message in messages]
+
+    def _materialize_message(self, message):
+        content = message.get("content")
+        if not isinstance(content, list) or not any(_is_ref(part) for part in content):
+            return message
+        parts = []
+        for part in content:
+            if _is_ref(part):
+                data_url = self.get(part.get("blob_id"))
+                if data_url is None:
+                    part = {"type": "text", "text": EXPIRED_IMAGE_TEXT}
+                else:
+                    part = {"type": "image_url", "image_url": {"url": data_url}}
+            parts.append(part)
+        return {**message, "content": parts}
+
+
+def expire_refs(messages):
+    """
+    Return `messages` with image_ref parts replaced by EXPIRED_IMAGE_TEXT, for
+    copies that outlive this process's store; other messages are shared.
+    """
+    return [_expire_message_refs(message) for message in messages]
+
+
+def _expire_message_refs(message):
+    content = message.get("content")
+    if not isinstance(content, list) or not any(_is_ref(part) for part in content):
+        return message
+    parts = [{"type": "text", "text": EXPIRED_IMAGE_TEXT} if _is_ref(part) else part for part in content]
+    return {**message, "content": parts}
+
+
+def _is_ref(part):
+    return isinstance(part, dict) and part.get("type") == IMAGE_REF
+
+
+def _data_url_of(part):
+    if not isinstance(part, dict) or part.get("type") != "image_url":
+        return None
+    payload = part.get("image_url")
+    url = payload.get("url") if isinstance(payload, dict) else payload
+    if isinstance(url, str) and url.startswith("data:"):
+        return url
+    return None
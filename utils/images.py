@@ -1,46 +1,103 @@
-from PIL import Image
-import base64
+from PIL import Image, UnidentifiedImageError
+from functools import lru_cache
+import binascii
 import io
 
 
+# Formats tried first when opening uploads, before PIL sniffs every registered format
+COMMON_IMAGE_FORMATS = ("JPEG", "PNG", "WEBP")
+
+# Decompression-bomb guard, checked from the header when an image is opened:
+# Pillow warns above this many pixels and refuses images over twice as large,
+# so oversized uploads fail before any pixel data is decoded
+MAX_IMAGE_PIXELS = 50_000_000
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+# Images with a longer side than this are resized with libvips when available
+VIPS_RESIZE_MIN_SIDE = 4000
+# 8-bit modes that map one-to-one onto a libvips uchar image
+VIPS_BANDS = {"L": 1, "RGB": 3, "RGBA": 4}
+
+
+def open_image(fp) -> Image.Image:
+    """Open an image, probing the common upload formats before all the others."""
+    try:
+        return Image.open(fp, formats=COMMON_IMAGE_FORMATS)
+    except UnidentifiedImageError:
+        fp.seek(0)
+        return Image.open(fp)
+
+
+def openai_target_size(width: int, height: int) -> tuple[int, int]:
+    """
+    Size an image must be scaled to for the OpenAI vision constraints:
+    - High-res mode: long side <= 2000px, short side <= 768px
+    Only downsizes; never upscales.
+    """
+    # The tighter of the two caps wins; 1.0 keeps images already within limits
+    scale = min(2000 / max(width, height), 768 / min(width, height), 1.0)
+    if scale == 1.0:
+        return width, height
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
 def openai_requirements_image_resize(img: Image.Image) -> Image.Image:
     """
     Resize the image according to OpenAI vision constraints:
     - High-res mode: long side <= 2000px, short side <= 768px
     Only downsizes; never upscales.
     """
-    width, height = img.size
-
-    # If already within limits, return as-is
-    if width <= 2000 and height <= 2000 and min(width, height) <= 768:
+    target_size = openai_target_size(*img.size)
+    if target_size == img.size:
         return img
+    if max(img.size) > VIPS_RESIZE_MIN_SIDE and img.mode in VIPS_BANDS and _pyvips() is not None:
+        return _vips_resize(img, target_size)
+    # reducing_gap first shrinks by an integer factor with a cheap box filter,
+    # leaving LANCZOS only the last (at most 3x) step
+    return img.resize(target_size, Image.LANCZOS, reducing_gap=3.0)
+
+
+@lru_cache(maxsize=None)
+def _pyvips():
+    # Optional; loading libvips is deferred until an image is large enough to need it
+    try:
+        import pyvips
+    except ImportError:
+        return None
+    return pyvips
 
-    aspect_ratio = width / height
-    new_width, new_height = width, height
 
-    # First, cap the long side to 2000
-    if max(width, height) > 2000:
-        if width > height:
-            new_width = 2000
-            new_height = int(new_width / aspect_ratio)
-        else:
-            new_height = 2000
-            new_width = int(new_height * aspect_ratio)
+def _vips_resize(img: Image.Image, target_size: tuple[int, int]) -> Image.Image:
+    pyvips = _pyvips()
+    # libvips resizes in parallel tiles without holding the GIL; pixels are
+    # handed over as raw bytes, so nothing is re-encoded on the way
+    width, height = img.size
+    vips_img = pyvips.Image.new_from_memory(img.tobytes(), width, height, VIPS_BANDS[img.mode], "uchar")
+    resized = vips_img.resize(target_size[0] / width, vscale=target_size[1] / height, kernel="lanczos3")
+    return Image.frombytes(img.mode, (resized.width, resized.height), resized.write_to_memory())
+
+
+def prepare_image_for_openai(img: Image.Image) -> Image.Image:
+    """
+    Like openai_requirements_image_resize, but first lets JPEG decoding
+    downscale by a power of two (DCT scaling) towards the target size, so
+    large photos are decoded at a fraction of their full resolution.
+    Must be called before the image data is loaded.
+    """
+    target_size = openai_target_size(*img.size)
+    if target_size != img.size:
+        img.draft("RGB", target_size)
+    return openai_requirements_image_resize(img)
 
-    # Then ensure the short side <= 768
-    if min(new_width, new_height) > 768:
-        if new_width < new_height:
-            new_width = 768
-            new_height = int(new_width / aspect_ratio)
-        else:
-            new_height = 768
-            new_width = int(new_height * aspect_ratio)
 
-    # Only downsizing
-    new_width = min(width, new_width)
-    new_height = min(height, new_height)
+# Images are re-encoded only for the LLM, so favor encode speed over file size:
+# no extra Huffman pass for JPEG, fast zlib level for PNG.
+# Pillow-SIMD can be installed in place of Pillow for faster resize/encode.
+JPEG_SAVE_OPTIONS = {"quality": 85, "subsampling": 2, "optimize": False, "progressive": False}
+PNG_SAVE_OPTIONS = {"compress_level": 1}
 
-    return img.resize((new_width, new_height), Image.LANCZOS)
+SAVE_OPTIONS = {"JPEG": JPEG_SAVE_OPTIONS, "PNG": PNG_SAVE_OPTIONS}
+MIME_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp"}
 
 
 def encode_image_to_data_url(img: Image.Image, fmt: str = "JPEG") -> str:
@@ -48,10 +105,13 @@ def encode_image_to_data_url(img: Image.Image, fmt: str = "JPEG") -> str:
     Encode a PIL image to a base64 data URL (default JPEG).
     Converts to RGB for JPEG safety.
     """
+    fmt = fmt.upper()
+    if fmt == "JPEG" and img.mode != "RGB":
+        img = img.convert("RGB")  # convert() copies even when the mode already matches
     buf = io.BytesIO()
-    if fmt.upper() == "JPEG":
-        img = img.convert("RGB")
-    img.save(buf, format=fmt)
-    b64 = base64.b64encode(buf.getvalue()).decode("utf-8")
-    mime = "image/jpeg" if fmt.upper() == "JPEG" else f"image/{fmt.lower()}"
+    img.save(buf, format=fmt, **SAVE_OPTIONS.get(fmt, {}))
+    # Encode straight from the buffer's memoryview, without a bytes copy of the image
+    with buf.getbuffer() as view:
+        b64 = binascii.b2a_base64(view, newline=False).decode("ascii")
+    mime = MIME_TYPES.get(fmt) or f"image/{fmt.lower()}"
     return f"data:{mime};base64,{b64}"
@@ -0,0 +1,33 @@
+IMAGE_PART_TYPES = frozenset(("image", "image_url"))
+VIDEO_PART_TYPES = frozenset(("video", "video_url"))
+
+
+def last_user_parts(messages):
+    """
+    Scan the newest message once and return (text, has_image, has_video).
+
+    Text parts are joined by spaces; a plain-string content is returned as is.
+    All three values are None when there are no messages or the newest one
+    is not from the user, so callers can bail out with a single check.
+    """
+    if not len(messages):
+        return None, None, None
+    message = messages[-1]
+    if message.get("role") != "user":
+        return None, None, None
+    content = message.get("content")
+    if isinstance(content, str):
+        return content, False, False
+    text_parts = []
+    has_image = has_video = False
+    for part in content if isinstance(content, list) else ():
+        if not isinstance(part, dict):
+            continue
+        part_type = part.get("type")
+        if part_type == "text":
+            text_parts.append(part.get("text", ""))
+        elif part_type in IMAGE_PART_TYPES:
+            has_image = True
+        elif part_type in VIDEO_PART_TYPES:
+            has_video = True
+    return " ".join(text_parts), has_image, has_video